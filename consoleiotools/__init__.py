@@ -1,19 +1,42 @@
-from functools import wraps
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+import atexit
+import codecs
+import collections
+import collections.abc
+import contextvars
+import io
+import os
+import queue
 import sys
+import threading
+import time
+import types
 
+import rich.cells
 import rich.console
 import rich.theme
-import rich.panel
 import rich.text
-import rich.progress
-import rich.traceback
-import rich.markdown
-import rich.box
 import rich.markup
 
 __version__ = "6.0.0"
 __ascii__ = False
-theme = rich.theme.Theme({
+_background_writer = None  # set by background()
+_answers = None  # set by answers()
+_quiet_threads = set()  # idents of the threads running a quiet answers() prompt
+_asked = ""  # text of the latest ask(), answers() looks answers up by it
+_backend = None  # set by set_backend(), None renders with rich
+_level = 0  # set by set_level(), echo-level output below it is skipped
+_context_level = contextvars.ContextVar("consoleiotools_level", default=None)  # set by level(), overrides _level in its thread or task
+_profile = None  # set by enable_profiling()
+_sessions = []  # names of the open sessions, innermost last
+_indent_base = 0  # echo indent added inside nested sessions
+_session_times = {}  # session name -> [calls, total, min, max] seconds
+_last_profile = None  # kept by disable_profiling()
+_capture_consoles = {}  # thread ident -> console of its capture()
+_capture_pool = {}  # (width, ansi, theme) -> idle capture consoles
+_capture_pool_lock = threading.Lock()
+THEME_STYLES = {
     "echo": "",
     "echo-bar": "",
     "echo-pre": "dim",
@@ -46,16 +69,137 @@ theme = rich.theme.Theme({
     "pause": "bright_yellow",
     "choice-i": "yellow",
     "choice-cmd": "yellow underline",
-})
-console = rich.console.Console(theme=theme)  # main output printer
+}
+
+
+def __getattr__(name: str):
+    """Build `theme`, `console` and `LoggingHandler` on first access, so importing stays cheap."""
+    if name == "theme":
+        return _get_theme()
+    if name == "console":
+        return _get_console()
+    if name == "LoggingHandler":
+        return globals().setdefault("LoggingHandler", _logging_handler_class())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _get_theme() -> rich.theme.Theme:
+    theme = globals().get("theme")
+    if theme is None:
+        theme = globals().setdefault("theme", rich.theme.Theme(THEME_STYLES))
+    return theme
+
+
+def _get_console() -> rich.console.Console:
+    """The main output printer, or the console of the running `capture()` in this thread. Assign `cit.console` to replace it."""
+    if _capture_consoles:
+        console = _capture_consoles.get(threading.get_ident())
+        if console is not None:
+            return console
+    console = globals().get("console")
+    if console is None:
+        console = globals().setdefault("console", rich.console.Console(theme=_get_theme()))
+    return console
+
+
+def _deferrable(func):  # decorator
+    """Hand the call to the writer thread while `background()` is on, skip it in a quiet `answers()` prompt. Decorated functions must return the module.
+
+    Calls from a thread in `capture()` always run in place, to be captured.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if _quiet_threads and threading.get_ident() in _quiet_threads:
+            return sys.modules[__name__]  # chaining
+        writer = _background_writer
+        if writer is not None and threading.current_thread() is not writer.thread and threading.get_ident() not in _capture_consoles:
+            writer.put(func, args, kwargs)
+            return sys.modules[__name__]  # chaining
+        return func(*args, **kwargs)
+    return wrapper
 
 
 def pretty_traceback(show_locals: bool = True) -> None:
+    import rich.traceback
+
     rich.traceback.install(show_locals=show_locals)
 
 
+def _session_indent(indent: int) -> int:
+    """`indent` of an echo line inside the open sessions. A negative indent stays the last line of its level."""
+    return indent - _indent_base if indent < 0 else indent + _indent_base
+
+
+def _format_elapsed(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    if seconds < 60:
+        return f"{seconds:.2f} s"
+    minutes, seconds = divmod(seconds, 60)
+    return f"{minutes:.0f}m {seconds:02.0f}s"
+
+
+@contextmanager
+def session(name: str):
+    """A titled block of output, closed by a line with its elapsed time, also when an exception is raised.
+
+    A session opened inside another one is shown as a branch of it: its header is indented, and so is the output of `echo()` and its wrappers inside it.
+    Elapsed times are summed up per name, see `session_times()`. While profiling is on, the cit calls, time and bytes of the session are shown before its end, see `enable_profiling()`.
+    Sessions are tracked for the whole program, open them from one thread.
+
+    Args:
+        name: str. The title of the session.
+    """
+    global _indent_base
+    base = _indent_base
+    if _sessions:
+        _echo(f"[title]{escape(name)}[/]", indent=_session_indent(1))
+        _indent_base = base + 2
+    else:
+        start()
+        title(name)
+    _sessions.append(name)
+    profile = _profile
+    before = list(profile.totals) if profile is not None else None
+    error = None
+    t = time.perf_counter()
+    try:
+        yield sys.modules[__name__]
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.perf_counter() - t
+        times = _session_times.setdefault(name, [0, 0.0, elapsed, elapsed])
+        times[0] += 1
+        times[1] += elapsed
+        times[2] = min(times[2], elapsed)
+        times[3] = max(times[3], elapsed)
+        if profile is not None and profile is _profile:
+            calls, seconds, written = (now - then for now, then in zip(profile.totals, before))
+            mute(f"{calls} cit calls, {seconds * 1000:.1f} ms, {written} bytes")
+        closing = f"[dim]{_format_elapsed(elapsed)}[/]"
+        if error is not None:
+            closing = f"[err]{escape(type(error).__name__)}[/] {closing}"
+        _sessions.pop()
+        _indent_base = base
+        if _sessions:
+            _echo(closing, indent=-(base + 2))
+        else:
+            end(closing)
+
+
+def session_times() -> dict:
+    """Elapsed times of the sessions, summed up per name.
+
+    Returns:
+        dict: Session name -> {"calls", "total", "mean", "min", "max"}, in seconds.
+    """
+    return {name: {"calls": calls, "total": total, "mean": total / calls, "min": shortest, "max": longest} for name, (calls, total, shortest, longest) in _session_times.items()}
+
+
 def as_session(name_or_func):  # decorator
-    """print start/title/end info before and after the function call
+    """print start/title/end info before and after the function call, see `session()`
 
     Args:
         title: title will show after the start, if has any
@@ -72,11 +216,8 @@ def as_session(name_or_func):  # decorator
     def get_func(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            start()
-            title(name)
-            result = func(*args, **kwargs)
-            end()
-            return result
+            with session(name):
+                return func(*args, **kwargs)
         return wrapper
     return get_func
 
@@ -97,6 +238,7 @@ def deprecated_by(new_func):  # decorator
         def wrapper(*args, **kwargs):
             with contextlib.redirect_stdout(sys.stderr):
                 warn(f"DeprecationWarning: Function `{old_func.__name__}` is deprecated, now calling `{new_func.__name__}` instead.")
+                flush()  # written while stdout is still redirected
             return new_func(*args, **kwargs)
         return wrapper
     return call_new_func
@@ -107,18 +249,58 @@ def start():
     return sys.modules[__name__]  # chaining
 
 
-def end():
-    console.print("`" if __ascii__ else "╰")
+@_deferrable
+def end(*args):
+    """print the end line, followed by `args` if any"""
+    if _backend is not None:
+        return sys.modules[__name__]  # chaining
+    _get_console().print(" ".join(["`" if __ascii__ else "╰", *(f"{arg}" for arg in args)]))
     return sys.modules[__name__]  # chaining
 
 
 def br(count=1):
     """print 1 to N blank lines"""
+    if _backend is not None:
+        return sys.modules[__name__]  # chaining
     print("\n" * (count - 1))
     return sys.modules[__name__]  # chaining
 
 
-def echo(*args, pre: str = "", bar: str = "|" if __ascii__ else "│", style: str = "echo", indent: int = 0, **options):
+def _indent_deco(indent: int) -> str:
+    """The tree-like decoration for an indent level. A negative level is the last line of its indent."""
+    indent_char_stem = "|   " if __ascii__ else "╷   "
+    indent_char_branch = "|-- " if __ascii__ else "├── "
+    indent_char_leaf = "`-- " if __ascii__ else "╰── "
+    if indent < 0:
+        return indent_char_stem * (-indent - 1) + indent_char_leaf
+    return indent_char_stem * (indent - 1) + indent_char_branch
+
+
+def _is_plain(console: rich.console.Console) -> bool:
+    """True if the console renders no styles at all, e.g. stdout piped to a file or a log collector.
+
+    Not while a `console.capture()` or `with console:` buffers the output, which a direct write would skip or reorder.
+    """
+    buffering = getattr(console, "_buffer_index", 1)  # private to rich, without it the fast path is off rather than out of order
+    return console.color_system is None and not console.record and not console.quiet and not buffering
+
+
+def _plain_markup(txt: str) -> str:
+    """Text of `txt` with markup tags and emoji codes resolved, without building a Text if there are none."""
+    if "[" in txt or ":" in txt:
+        return rich.text.Text.from_markup(txt).plain
+    return txt
+
+
+@lru_cache(maxsize=512)
+def _echo_prefix(style: str, pre: str, bar: str, indent: int, ascii_only: bool, theme: rich.theme.Theme) -> tuple:
+    """Styled and plain prefix (bar, pre and indent) of an echo line.
+
+    `ascii_only` and `theme` are part of the cache key, so a new `cit.theme` or a changed `cit.__ascii__` gets fresh prefixes.
+
+    Returns:
+        tuple[rich.text.Text, str]: The styled prefix, which must be copied before appending, and its plain text.
+    """
     txt = rich.text.Text()
     if bar:
         txt.append(f"{bar}", style=f"{style}-bar" if f"{style}-bar" in theme.styles else style)
@@ -127,70 +309,377 @@ def echo(*args, pre: str = "", bar: str = "|" if __ascii__ else "│", style: st
         txt.append(f"({pre.capitalize()})", style=f"{style}-pre" if f"{style}-pre" in theme.styles else style)
         txt.append(" ")
     if indent:
-        indent_char_stem = "|   " if __ascii__ else "╷   "
-        indent_char_branch = "|-- " if __ascii__ else "├── "
-        indent_char_leaf = "`-- " if __ascii__ else "╰── "
-        if indent < 0:
-            indent = -indent
-            indent_deco = indent_char_leaf
-        else:
-            indent_deco = indent_char_branch
-        indent_deco = indent_char_stem * (indent - 1) + indent_deco
-        txt.append(f"{indent_deco}", style=f"{style}-indent" if f"{style}-indent" in theme.styles else style)
+        txt.append(_indent_deco(indent), style=f"{style}-indent" if f"{style}-indent" in theme.styles else style)
+    return txt, txt.plain
+
+
+def _echo_plain(console: rich.console.Console, prefix: str, args: tuple) -> bool:
+    """Write an echo line straight to the console file. Returns False if rich has to render it instead."""
+    line = prefix + " ".join(_plain_markup(f"{arg}") for arg in args)
+    if not line.isprintable() or rich.cells.cell_len(line) > console.width:  # tabs, newlines, control codes or wrapping
+        return False
+    file = console.file
+    try:
+        file.write(line + "\n")
+        file.flush()
+    except BrokenPipeError:
+        console.on_broken_pipe()
+    return True
+
+
+_RECORD_LEVELS = {"err": "error", "warn": "warning"}  # echo style -> record level, if not the same
+
+
+def _record(level: str, args, indent: int = 0) -> dict:
+    """An output record for the backend set by `set_backend()`, with markup stripped from the message."""
+    return {"level": _RECORD_LEVELS.get(level, level), "message": " ".join(_plain_markup(f"{arg}") for arg in args), "indent": abs(indent), "time": time.time()}
+
+
+def _write_jsonl(record: dict):
+    """The "jsonl" backend: one compact JSON object per line, written to the console file without rendering.
+
+    Only warnings and errors are flushed right away. The others are left to the file buffer, `flush()`, `buffered()` and the exit.
+    """
+    import json
+
+    console = _get_console()
+    file = console.file
+    try:
+        file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        if record["level"] in ("warning", "error"):
+            file.flush()
+    except BrokenPipeError:
+        console.on_broken_pipe()
+
+
+_BACKENDS = {"jsonl": _write_jsonl}
+
+
+def set_backend(backend="rich"):
+    """Choose how `echo()` and its wrappers, `title()` and `rule()` write their output.
+
+    A record is a dict of `level` (the style, like info, warning, error, debug, muted, echo, title or rule), `message` (without markup), `indent` and `time` (a Unix timestamp).
+    `br()` and `end()` are decorations only, they write nothing unless the backend is "rich".
+
+    Args:
+        backend: str or callable. "rich" renders for humans. "jsonl" writes one JSON record per line, to the same file the console writes to. A callable gets each record.
+    """
+    global _backend
+    if callable(backend):
+        _backend = backend
+    elif backend == "rich":
+        _backend = None
+    elif backend in _BACKENDS:
+        _backend = _BACKENDS[backend]
+        atexit.unregister(flush)  # registered once
+        atexit.register(flush)  # records are not flushed one by one
+    else:
+        raise ValueError(f"backend must be 'rich', {', '.join(map(repr, _BACKENDS))} or a callable, not {backend!r}.")
+    return sys.modules[__name__]  # chaining
+
+
+LEVELS = {"debug": 10, "mute": 15, "info": 20, "warn": 30, "warning": 30, "err": 40, "error": 40}
+_STYLE_LEVELS = {"debug": LEVELS["debug"], "muted": LEVELS["mute"], "warn": LEVELS["warn"], "err": LEVELS["err"]}  # echo style -> level, the others are at info level
+
+
+def _level_value(level) -> int:
+    if isinstance(level, int):
+        return level
+    if level not in LEVELS:
+        raise ValueError(f"level must be an int or one of {', '.join(LEVELS)}, not {level!r}.")
+    return LEVELS[level]
+
+
+def _skipped(value: int) -> bool:
+    """If output at level `value` is below the level of this thread or task."""
+    level = _context_level.get()
+    return (_level if level is None else level) > value
+
+
+def set_level(level):
+    """Skip output of `echo()` and its wrappers below `level`. The arguments of skipped calls are not formatted.
+
+    `ask()` is never skipped, as prompts need it. Pass functions taking no arguments, like lambdas, to `echo()` and its wrappers to defer costly messages: they are only called if the output is shown.
+
+    Args:
+        level: str or int. debug (10, shows all), mute (15), info (20, also `echo()`), warn (30) or err (40). Ints follow the `logging` levels.
+    """
+    global _level  # the default of all threads, level() overrides it in its own context
+    _level = _level_value(level)
+    return sys.modules[__name__]  # chaining
+
+
+@contextmanager
+def level(level):
+    """`set_level()` for a `with` block, in the current thread or asyncio task only. The level before is restored after it."""
+    token = _context_level.set(_level_value(level))
+    try:
+        yield sys.modules[__name__]
+    finally:
+        _context_level.reset(token)
+
+
+def echo(*args, pre: str = "", bar: str = "|" if __ascii__ else "│", style: str = "echo", indent: int = 0, **options):
+    if _skipped(_STYLE_LEVELS.get(style, LEVELS["info"])):
+        return sys.modules[__name__]  # chaining
+    if _indent_base:
+        indent = _session_indent(indent)
+    return _echo(*args, pre=pre, bar=bar, style=style, indent=indent, **options)
+
+
+@_deferrable
+def _echo(*args, pre: str = "", bar: str = "|" if __ascii__ else "│", style: str = "echo", indent: int = 0, **options):
+    """`echo()` after its level check, which the wrappers do by themselves."""
+    for arg in args:
+        if type(arg) is types.FunctionType:  # lazy arguments, called once
+            args = tuple(arg() if type(arg) is types.FunctionType else arg for arg in args)
+            break
+    if _backend is not None:
+        _backend(_record(style, args, indent))
+        return sys.modules[__name__]  # chaining
+    console = _get_console()
+    prefix, plain_prefix = _echo_prefix(style, pre, bar, indent, __ascii__, _get_theme())
+    if not options and _is_plain(console) and _echo_plain(console, plain_prefix, args):
+        return sys.modules[__name__]  # chaining
+    txt = prefix.copy()
     contents = rich.text.Text(" ").join(rich.text.Text.from_markup(f"{arg}") for arg in args)
     contents.stylize(style)
-    txt.append(contents)
+    txt.append_text(contents)
     console.print(txt, **options)
     return sys.modules[__name__]  # chaining
 
 
+@_deferrable
 def title(*args, **options):
     """print something like a title"""
-    console.print(rich.panel.Panel((" ".join([f"{arg}" for arg in args])).upper().strip(), highlight=True, expand=False, box=rich.box.ASCII if __ascii__ else rich.box.ROUNDED), **options)
+    if _backend is not None:
+        _backend(_record("title", args))
+        return sys.modules[__name__]  # chaining
+    import rich.panel
+    import rich.box
+
+    _get_console().print(rich.panel.Panel((" ".join([f"{arg}" for arg in args])).upper().strip(), highlight=True, expand=False, box=rich.box.ASCII if __ascii__ else rich.box.ROUNDED), **options)
     return sys.modules[__name__]  # chaining
 
 
+def _echo_as(level, args: tuple, options: dict, **style):
+    """Body of the `echo()` wrappers: skip output below `level` (None never skips), indent it into the open sessions, then `_echo()` it."""
+    if level is not None and _skipped(LEVELS[level]):
+        return sys.modules[__name__]  # chaining
+    if _indent_base:
+        options["indent"] = _session_indent(options.get("indent", 0))
+    return _echo(*args, **style, **options)
+
+
 def ask(*args, **options):
-    return echo(*args, pre="?", style="ask", **options)
+    global _asked
+    _asked = " ".join(f"{arg}" for arg in args)
+    return _echo_as(None, args, options, pre="?", style="ask")  # prompts need it at any level
 
 
 def info(*args, **options):
-    return echo(*args, pre="info", style="info", **options)
+    return _echo_as("info", args, options, pre="info", style="info")
 
 
 def warn(*args, **options):
-    return echo(*args, pre="warning", style="warn", **options)
+    return _echo_as("warn", args, options, pre="warning", style="warn")
 
 
 def err(*args, **options):
-    return echo(*args, pre="error", style="err", **options)
+    return _echo_as("err", args, options, pre="error", style="err")
 
 
 def mute(*args, **options):
-    return echo(*args, style="muted", **options)
+    return _echo_as("mute", args, options, style="muted")
 
 
 def debug(*args, **options):
-    return echo(*args, pre="debug", style="debug", **options)
-
-
+    return _echo_as("debug", args, options, pre="debug", style="debug")
+
+
+def _logging_handler_class():
+    """Define `LoggingHandler`, which subclasses `logging.Handler`, without importing `logging` with cit."""
+    import logging
+    import logging.handlers
+
+    class LoggingHandler(logging.Handler):
+        """A `logging` handler writing records like cit does: DEBUG as `debug()`, INFO as `info()`, WARNING as `warn()`, ERROR and CRITICAL as `err()`.
+
+        Records are skipped below the level of `set_level()` or `level()` too. Messages are escaped, so `[` in them is not markup.
+
+        Args:
+            level: int. The handler level, as for `logging.Handler`.
+            indent: int. Indent level of every record.
+            pre: str. Shown before every record instead of its level, like `(Info)`. "" for none, None for the level.
+            queued: bool. Only queue records in `emit()`, a thread writes them. Call `close()` to write out the queue, `logging.shutdown()` does at exit.
+        """
+
+        def __init__(self, level=logging.NOTSET, indent: int = 0, pre: str = None, queued: bool = False):
+            super().__init__(level)
+            self.indent = indent
+            self.pre = pre
+            self._styles = {}  # record level -> (cit level, pre, style)
+            self._checks_level = True
+            self.listener = None
+            if queued:
+                self.queue = queue.SimpleQueue()
+                handler = LoggingHandler(indent=indent, pre=pre)
+                handler._checks_level = False  # checked by emit() here, in the context of the logging call
+                self.listener = logging.handlers.QueueListener(self.queue, handler)
+                self.listener.start()
+
+        def _style(self, levelno: int) -> tuple:
+            style = self._styles.get(levelno)
+            if style is None:
+                if levelno >= logging.ERROR:
+                    style = (LEVELS["err"], "error", "err")
+                elif levelno >= logging.WARNING:
+                    style = (LEVELS["warn"], "warning", "warn")
+                elif levelno >= logging.INFO:
+                    style = (LEVELS["info"], "info", "info")
+                else:
+                    style = (LEVELS["debug"], "debug", "debug")
+                if self.pre is not None:
+                    style = (style[0], self.pre, style[2])
+                style = self._styles.setdefault(levelno, style)
+            return style
+
+        def emit(self, record):
+            try:
+                min_level, pre, style = self._style(record.levelno)
+                if self._checks_level and _skipped(min_level):
+                    return
+                if self.listener is not None:
+                    self.queue.put_nowait(logging.handlers.QueueHandler.prepare(self, record))  # formatted on the calling thread, as QueueHandler does
+                    return
+                _echo(escape(self.format(record)), pre=pre, style=style, indent=_session_indent(self.indent))
+            except Exception:
+                self.handleError(record)
+
+        def close(self):
+            if self.listener is not None:
+                self.listener.stop()  # writes out the queued records
+                self.listener = None
+            super().close()
+
+    return LoggingHandler
+
+
+@_deferrable
 def print(*args, **options):
-    console.print(*args, **options)
+    _get_console().print(*args, **options)
     return sys.modules[__name__]  # chaining
 
 
+MARKDOWN_CACHE_SIZE = 64  # rendered documents markdown() remembers
+_markdown_cache = collections.OrderedDict()  # (source digest, width, theme, __ascii__) -> segments, least recent first
+_markdown_cache_stats = {"hits": 0, "misses": 0}
+_markdown_cache_lock = threading.Lock()
+
+
+def markdown_cache_info() -> dict:
+    """Hits, misses and size of the `markdown()` cache."""
+    with _markdown_cache_lock:
+        return dict(_markdown_cache_stats, maxsize=MARKDOWN_CACHE_SIZE, currsize=len(_markdown_cache))
+
+
+def markdown_cache_clear():
+    """Empty the `markdown()` cache and reset its stats."""
+    with _markdown_cache_lock:
+        _markdown_cache.clear()
+        _markdown_cache_stats.update(hits=0, misses=0)
+
+
+@_deferrable
 def markdown(*args, **options):
-    console.print(rich.markdown.Markdown(" ".join([f"{arg}" for arg in args])))
+    """Print markdown. The rendered output is cached, so repeat displays of the same document skip parsing and layout.
+
+    The cache is keyed on the source, the console width, `cit.theme` and `cit.__ascii__`, see `markdown_cache_info()`.
+
+    Args:
+        *args: str. Joined with spaces as the markdown source.
+    """
+    import hashlib
+    import rich.segment
+
+    source = " ".join([f"{arg}" for arg in args])
+    console = _get_console()
+    key = (hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size=16).digest(), console.width, _get_theme(), __ascii__)
+    with _markdown_cache_lock:
+        segments = _markdown_cache.get(key)
+        if segments is None:
+            _markdown_cache_stats["misses"] += 1
+        else:
+            _markdown_cache.move_to_end(key)
+            _markdown_cache_stats["hits"] += 1
+    if segments is None:
+        import rich.markdown
+
+        segments = list(console.render(rich.markdown.Markdown(source)))
+        with _markdown_cache_lock:
+            _markdown_cache[key] = segments
+            while len(_markdown_cache) > MARKDOWN_CACHE_SIZE:
+                _markdown_cache.popitem(last=False)
+    console.print(rich.segment.Segments(segments))
+    return sys.modules[__name__]  # chaining
+
+
+def _is_heading(text: str) -> bool:
+    """If a stripped markdown line is an ATX heading, like `## Title`."""
+    level = len(text) - len(text.lstrip("#"))
+    return 1 <= level <= 6 and (len(text) == level or text[level] in " \t")
+
+
+def markdown_file(path: str, chunk_size: int = 64 * 1024):
+    """Print a markdown file section by section, so a large file is shown as it is read, never parsed as a whole.
+
+    Sections start at the headings outside of code blocks. Each one is printed by `markdown()`, and cached the same way.
+    Reference-style links and footnotes only resolve within their own section.
+
+    Args:
+        path: str. The file to print, read by `iter_lines()`.
+        chunk_size: int. Bytes read at a time.
+    """
+    section = []  # lines of the current section
+    fence = ""  # opening ``` or ~~~ of the fenced code block we are in
+    printed = False
+    for line in iter_lines(path, chunk_size=chunk_size):
+        text = line.strip()
+        if len(line) - len(line.lstrip(" ")) < 4:  # deeper indents are code
+            if fence:
+                if text.startswith(fence) and not text.strip(fence[0]):
+                    fence = ""
+            elif text.startswith(("```", "~~~")):
+                fence = text[:len(text) - len(text.lstrip(text[0]))]
+            elif _is_heading(text) and "".join(section).strip():
+                if printed:
+                    print()  # the blank line between blocks, as in a whole document
+                markdown("".join(section))
+                printed = True
+                section.clear()
+        section.append(line)
+    if "".join(section).strip():
+        if printed:
+            print()
+        markdown("".join(section))
     return sys.modules[__name__]  # chaining
 
 
+@_deferrable
 def rule(title: str, *args, **options):
-    console.rule(title, *args, characters="-" if __ascii__ else "─", **options)
+    if _backend is not None:
+        _backend(_record("rule", (title,)))
+        return sys.modules[__name__]  # chaining
+    _get_console().rule(title, *args, characters="-" if __ascii__ else "─", **options)
     return sys.modules[__name__]  # chaining
 
 
+@_deferrable
 def panel(txt, title="", subtitle="", expand=True, highlight=True, style="", **options):
-    console.print(
+    import rich.panel
+    import rich.box
+
+    _get_console().print(
         rich.panel.Panel(
             txt,
             title=title,
@@ -198,7 +687,7 @@ def panel(txt, title="", subtitle="", expand=True, highlight=True, style="", **o
             highlight=highlight,
             expand=expand,
             style=style,
-            border_style=f"{style}-pre" if f"{style}-pre" in theme.styles else "",
+            border_style=f"{style}-pre" if f"{style}-pre" in _get_theme().styles else "",
             box=rich.box.ASCII if __ascii__ else rich.box.ROUNDED,
             **options
         )
@@ -218,11 +707,582 @@ def escape(txt: str) -> str:
     return rich.markup.escape(txt)
 
 
+def _console_file(console: rich.console.Console):
+    """The file `console` was given, None if it follows sys.stdout (or sys.stderr). Rich keeps it private, `console.file` resolves None."""
+    return getattr(console, "_file", console.file)
+
+
+def _remove_file_proxy(console: rich.console.Console, proxy):
+    """Take `proxy`, a `_BufferedFile` or `_CountingFile`, out of the file chain of `console`, wherever it is in it.
+
+    `buffered()` and `enable_profiling()` can be nested either way, so the proxy on top is not always the one to remove.
+    """
+    outer = _console_file(console)
+    if outer is proxy:
+        console.file = proxy.file
+        return
+    while isinstance(outer, (_BufferedFile, _CountingFile)):
+        if outer.file is proxy:
+            outer.file = proxy.file
+            return
+        outer = outer.file
+
+
+class _BufferedFile:
+    """File proxy used by `buffered()`. Holds what the console writes and passes it on in large blocks."""
+
+    def __init__(self, file, max_lines: int, max_bytes: int, interval: float, stderr: bool = False):
+        self.file = file  # None follows sys.stdout, or sys.stderr if `stderr`
+        self.stderr = stderr
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._chunks = []
+        self._held_for = self.target  # where the held chunks go, sys.stdout may be redirected meanwhile
+        self._lines = 0
+        self._size = 0
+        self._last_drain = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def target(self):
+        if self.file is not None:
+            return self.file
+        return sys.stderr if self.stderr else sys.stdout
+
+    def __getattr__(self, name):  # isatty, fileno, encoding, etc.
+        return getattr(self.target, name)
+
+    def write(self, text: str) -> int:
+        target = self.target
+        if target is not self._held_for:  # redirected, write out what was held for the old target first
+            self.drain()
+            self._held_for = target
+        with self._lock:
+            self._chunks.append(text)
+            self._lines += text.count("\n")
+            self._size += len(text)
+        return len(text)
+
+    def flush(self):
+        """Called after every print. Only drains once a limit is reached."""
+        if self._lines >= self.max_lines or self._size >= self.max_bytes or time.monotonic() - self._last_drain >= self.interval:
+            self.drain()
+
+    def drain(self):
+        """Write out everything held, in one write."""
+        with self._lock:
+            if self._chunks:
+                self._held_for.write("".join(self._chunks))
+                self._chunks.clear()
+                self._lines = self._size = 0
+            self._held_for.flush()
+            self._last_drain = time.monotonic()
+
+
+@contextmanager
+def buffered(max_lines: int = 1000, max_bytes: int = 64 * 1024, interval: float = 1.0):
+    """Hold console output and write it in large blocks, instead of one write and flush per line.
+
+    Output is written when any limit is reached, on `flush()`, before prompts, and on exit.
+    The limits are checked on each print, there is no background timer.
+
+    Args:
+        max_lines: int. Write once this many lines are held.
+        max_bytes: int. Write once this many characters are held.
+        interval: float. Write once this many seconds passed since the last write.
+    """
+    console = _get_console()
+    buffered_file = console.file = _BufferedFile(_console_file(console), max_lines=max_lines, max_bytes=max_bytes, interval=interval, stderr=console.stderr)  # None follows sys.stdout on each write
+    try:
+        yield
+    finally:
+        _remove_file_proxy(console, buffered_file)
+        buffered_file.drain()
+
+
+class _BackgroundWriter:
+    """Single thread that runs queued output calls in order. Created by `background()`."""
+
+    def __init__(self, maxsize: int, on_full: str):
+        if on_full not in ("block", "drop"):
+            raise ValueError(f"on_full must be 'block' or 'drop', not {on_full!r}.")
+        self.on_full = on_full
+        self.dropped = 0  # calls discarded because the queue was full
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, name="consoleiotools-writer", daemon=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while True:
+            call = self.queue.get()
+            try:
+                if call is None:
+                    return
+                func, args, kwargs = call
+                func(*args, **kwargs)
+            except Exception:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def put(self, func, args: tuple, kwargs: dict):
+        if self.on_full == "block":
+            self.queue.put((func, args, kwargs))
+            return
+        try:
+            self.queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            self.dropped += 1
+
+    def join(self):
+        """Wait until everything queued so far is written."""
+        if self.thread.is_alive() and threading.current_thread() is not self.thread:
+            self.queue.join()
+
+    def stop(self):
+        """Write out the queue, then end the thread and leave background mode."""
+        global _background_writer
+        if _background_writer is self:
+            _background_writer = None
+        atexit.unregister(self.stop)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def background(maxsize: int = 10000, on_full: str = "block"):
+    """Render and write output on a background thread, so callers never wait for the terminal.
+
+    Output functions called from any thread are queued and run in order by one writer thread.
+    Prompts wait for the queue first. The queue is written out on `stop()`, at the end of a `with` block, or at exit.
+    Arguments are rendered later on the writer thread, so do not change them after the call.
+
+    Args:
+        maxsize: int. Most calls waiting in the queue.
+        on_full: str. When the queue is full, "block" waits for room, "drop" discards the call and counts it in `dropped`.
+
+    Returns:
+        The writer, which can be used as a context manager, or stopped by `stop()`.
+    """
+    global _background_writer
+    if _background_writer is not None:
+        raise RuntimeError("Background output is already on.")
+    writer = _BackgroundWriter(maxsize=maxsize, on_full=on_full)
+    writer.thread.start()
+    atexit.register(writer.stop)
+    _background_writer = writer
+    return writer
+
+
+def flush():
+    """Write out all output queued by `background()` or held by `buffered()`, and flush the console file."""
+    if _background_writer is not None:
+        _background_writer.join()
+    console = _get_console()
+    file = console.file
+    while isinstance(file, (_BufferedFile, _CountingFile)):
+        if isinstance(file, _BufferedFile):
+            file.drain()
+        file = file.target
+    try:
+        file.flush()
+    except BrokenPipeError:
+        console.on_broken_pipe()
+    return sys.modules[__name__]  # chaining
+
+
+@contextmanager
+def capture(width: int = 80, ansi: bool = False):
+    """Capture the output of cit calls in this thread, instead of printing it. Other threads keep printing as usual.
+
+    The output is rendered by an offscreen console taken from a pool, so captures are cheap and can run in parallel threads.
+
+    Args:
+        width: int. Width of the captured output, independent of the terminal.
+        ansi: bool. Keep styles as ANSI escape codes. Plain text if False.
+
+    Yields:
+        io.StringIO: The captured output. `getvalue()` works inside and after the block.
+    """
+    key = (width, ansi, _get_theme())
+    with _capture_pool_lock:
+        idle = _capture_pool.setdefault(key, [])
+        console = idle.pop() if idle else None
+    if console is None:
+        console = rich.console.Console(file=io.StringIO(), theme=key[2], width=width, force_terminal=ansi, color_system="truecolor" if ansi else None, force_interactive=False)
+    buffer = console.file = io.StringIO()
+    ident = threading.get_ident()
+    previous = _capture_consoles.get(ident)
+    _capture_consoles[ident] = console
+    try:
+        yield buffer
+    finally:
+        if previous is None:
+            del _capture_consoles[ident]
+        else:
+            _capture_consoles[ident] = previous
+        console.file = io.StringIO()  # the buffer stays with the caller
+        with _capture_pool_lock:
+            _capture_pool[key].append(console)
+
+
+def render(func, *args, width: int = 80, ansi: bool = False, **kwargs) -> str:
+    """Output of `func(*args, **kwargs)` as a str, see `capture()`.
+
+    Args:
+        func: callable. A cit function like `cit.panel`, or any function calling cit.
+        width: int. Width of the output.
+        ansi: bool. Keep styles as ANSI escape codes. Plain text if False.
+    """
+    with capture(width=width, ansi=ansi) as buffer:
+        func(*args, **kwargs)
+    return buffer.getvalue()
+
+
+_PROFILED = (  # functions timed by enable_profiling()
+    "echo", "ask", "info", "warn", "err", "mute", "debug", "print", "title", "panel", "markdown", "rule",
+    "track", "track_bytes", "track_map", "read_file", "write_file", "pause", "get_input", "get_choice", "get_choices",
+)
+
+
+class _ProfileLocal(threading.local):
+    """Per thread counters of the profile, so a call is only credited with what its own thread did."""
+
+    depth = 0  # nested profiled calls
+    written = 0  # bytes written to the console file
+    waited = 0.0  # seconds in input()
+
+
+class _Profile:
+    """Statistics gathered while `enable_profiling()` is on."""
+
+    def __init__(self):
+        self.rows = {}  # function name -> [calls, seconds, bytes, seconds in input()]
+        self.totals = [0, 0.0, 0]  # calls, seconds and bytes of the outermost calls, nested calls are part of them
+        self.input = [0, 0.0]  # calls and seconds of input()
+        self.lock = threading.Lock()
+        self.local = _ProfileLocal()
+        self.console = self.counting_file = None  # set by enable_profiling()
+
+    def add_input(self, seconds: float):
+        """Count a call of input() which waited `seconds`."""
+        self.local.waited += seconds
+        with self.lock:
+            self.input[0] += 1
+            self.input[1] += seconds
+
+    def add(self, name: str, calls: int, seconds: float, written: int = 0, waited: float = 0.0, outermost: bool = True):
+        with self.lock:
+            row = self.rows.setdefault(name, [0, 0.0, 0, 0.0])
+            row[0] += calls
+            row[1] += seconds
+            row[2] += written
+            row[3] += waited
+            if outermost:
+                self.totals[0] += calls
+                self.totals[1] += seconds
+                self.totals[2] += written
+
+    def timed(self, name: str, generator):
+        """Yield from `generator`, adding the time spent in it to `name`."""
+        seconds = 0.0
+        try:
+            while True:
+                t = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - t
+                yield item
+        finally:
+            generator.close()
+            self.add(name, 0, seconds)
+
+
+def _utf8_size(text: str) -> int:
+    """Bytes of `text` encoded as utf-8, without encoding ascii text."""
+    return len(text) if text.isascii() else len(text.encode("utf-8", "replace"))
+
+
+def _counted(content, sizes: list):
+    """`content` of `write_file()`, adding the utf-8 bytes of each piece to `sizes` as it is written."""
+    if isinstance(content, str):
+        sizes.append(_utf8_size(content))
+        return content
+    return (sizes.append(_utf8_size(piece)) or piece for piece in content)
+
+
+def _profiled(name: str, func):
+    """Wrap `func` to add its calls, time and console bytes to the profile."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _profile
+        if profile is None:  # profiling was turned off since
+            return func(*args, **kwargs)
+        sizes = []  # bytes written to the file by write_file(), which writes utf-8
+        if name == "write_file":
+            if len(args) > 1:
+                args = (args[0], _counted(args[1], sizes), *args[2:])
+            elif "content" in kwargs:
+                kwargs["content"] = _counted(kwargs["content"], sizes)
+        local = profile.local
+        depth, written, waited = local.depth, local.written, local.waited
+        local.depth = depth + 1
+        t = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - t
+            local.depth = depth
+            profile.add(name, 1, seconds, local.written - written, local.waited - waited, outermost=depth == 0)
+        if name == "write_file":
+            profile.add(name, 0, 0.0, sum(sizes), outermost=depth == 0)  # written to the file
+        if isinstance(result, types.GeneratorType):
+            return profile.timed(name, result)
+        return result
+    wrapper.__wrapped_by_profiling__ = func
+    return wrapper
+
+
+class _CountingFile:
+    """Console file proxy counting the bytes written, for the profile."""
+
+    def __init__(self, file, profile: _Profile, stderr: bool = False):
+        self.file = file  # None follows sys.stdout, or sys.stderr if `stderr`
+        self.stderr = stderr
+        self.profile = profile
+
+    @property
+    def target(self):
+        if self.file is not None:
+            return self.file
+        return sys.stderr if self.stderr else sys.stdout
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    def write(self, text: str) -> int:
+        self.profile.local.written += _utf8_size(text)  # per thread, each call only counts its own writes
+        return self.target.write(text)
+
+    def flush(self):
+        self.target.flush()
+
+
+def enable_profiling():
+    """Count the calls, time and bytes written to the console of the cit functions, and the time spent waiting in `input()`.
+
+    Profiled functions are swapped in the module, and swapped back by `disable_profiling()`, so there is no cost when profiling is off.
+    Calls through references taken before, like `from consoleiotools import info`, are not counted.
+    Time of `track()` and other generators is the time spent in them while iterating. Bytes are counted per thread, so parallel calls are not credited with each other's output.
+    With `background()` on, time is the queueing time, and bytes written by the background thread are not counted.
+    """
+    global _profile
+    if _profile is not None:
+        return sys.modules[__name__]  # chaining
+    _profile = _Profile()
+    module = globals()
+    for name in _PROFILED:
+        module[name] = _profiled(name, module[name])
+    console = _profile.console = _get_console()
+    console.file = _profile.counting_file = _CountingFile(_console_file(console), _profile, stderr=console.stderr)  # None follows sys.stdout on each write
+    return sys.modules[__name__]  # chaining
+
+
+def disable_profiling():
+    """Stop profiling, the statistics are kept for `stats()`."""
+    global _profile, _last_profile
+    if _profile is None:
+        return sys.modules[__name__]  # chaining
+    module = globals()
+    for name in _PROFILED:
+        module[name] = getattr(module[name], "__wrapped_by_profiling__", module[name])
+    _remove_file_proxy(_profile.console, _profile.counting_file)
+    _profile, _last_profile = None, _profile
+    return sys.modules[__name__]  # chaining
+
+
+def stats(reset: bool = False) -> dict:
+    """Statistics of the current or the last profiling, see `enable_profiling()`.
+
+    Args:
+        reset: bool. Start over after returning them.
+
+    Returns:
+        dict: Function name -> {"calls", "time" (seconds, nested calls included), "bytes" (written to the console, or to the file by `write_file()`), "input" (seconds waiting in `input()`)}.
+            Also "input()", and "total" for the outermost calls only.
+    """
+    profile = _profile or _last_profile
+    if profile is None:
+        return {}
+    with profile.lock:
+        result = {name: {"calls": calls, "time": seconds, "bytes": written, "input": waited} for name, (calls, seconds, written, waited) in profile.rows.items()}
+        result["input()"] = {"calls": profile.input[0], "time": profile.input[1], "bytes": 0, "input": profile.input[1]}
+        result["total"] = {"calls": profile.totals[0], "time": profile.totals[1], "bytes": profile.totals[2], "input": profile.input[1]}
+        if reset:
+            profile.rows.clear()
+            profile.totals[:] = [0, 0.0, 0]
+            profile.input[:] = [0, 0.0]
+    return result
+
+
+def print_stats(output: str = "table"):
+    """Print `stats()`, slowest first.
+
+    Args:
+        output: str. "table" in a `panel()`, or "json".
+    """
+    import json
+
+    data = stats()
+    if output == "json":
+        _get_console().print_json(json.dumps(data))
+        return sys.modules[__name__]  # chaining
+    if output != "table":
+        raise ValueError(f"output must be 'table' or 'json', not {output!r}.")
+    import rich.table
+
+    table = rich.table.Table(box=None, padding=(0, 1))
+    for column in ("Function", "Calls", "Time (ms)", "Avg (us)", "Bytes", "Input (ms)"):
+        table.add_column(column, justify="left" if column == "Function" else "right")
+    rows = sorted(data.items(), key=lambda item: (item[0] == "total", -item[1]["time"]))
+    for name, row in rows:
+        average = row["time"] / row["calls"] * 1e6 if row["calls"] else 0
+        table.add_row(name, f"{row['calls']}", f"{row['time'] * 1000:.2f}", f"{average:.1f}", f"{row['bytes']}", f"{row['input'] * 1000:.2f}", style="bold" if name == "total" else "")
+    return panel(table, title="Profiling", expand=False)
+
+
+def _input() -> str:
+    """`input()`, timed while profiling."""
+    profile = _profile
+    if profile is None:
+        return input()
+    t = time.perf_counter()
+    try:
+        return input()
+    finally:
+        profile.add_input(time.perf_counter() - t)
+
+
+_NO_ANSWER = object()  # yielded by prompt steps which `answers()` should not answer, like pause()
+
+
+class _Answers:
+    """Pre-supplied answers for prompts, see `answers()`."""
+
+    def __init__(self, source, quiet: bool = False):
+        if isinstance(source, str):
+            raise ValueError("Answers should be an iterable of str or a dict, not a str.")
+        if isinstance(source, collections.abc.Mapping):
+            self.by_question = {question: collections.deque([answer] if isinstance(answer, str) else answer) for question, answer in source.items()}
+            self.in_order = iter(())
+        else:
+            self.by_question = {}
+            self.in_order = iter(source)
+        self.quiet = quiet
+        self._previous = None
+
+    def next(self, question: str) -> str:
+        """The answer to `question`, or the next answer in order. Raises EOFError if there is none."""
+        answers = self.by_question.get(question)
+        if answers:
+            return answers.popleft()
+        for answer in self.in_order:
+            return answer.rstrip("\r\n")  # lines read from a file keep their line ending
+        raise EOFError(f"No answer for {question!r}." if question else "No more answers.")
+
+    def run(self, steps):
+        """Run prompt steps like `_prompt()`, sending answers instead of lines from `input()`."""
+        global _asked
+        ident = threading.get_ident()
+        if self.quiet:
+            _quiet_threads.add(ident)
+        try:
+            request = next(steps)
+            while True:
+                answer = ""
+                if request is not _NO_ANSWER:
+                    answer = self.next(_asked)
+                    if not self.quiet:
+                        print(escape(answer), highlight=False)  # as if typed
+                request = steps.send(answer)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            steps.close()
+            _quiet_threads.discard(ident)
+            _asked = ""
+
+    def start(self):
+        global _answers
+        self._previous, _answers = _answers, self
+        return self
+
+    def stop(self):
+        """Go back to the answers in use before, or to stdin."""
+        global _answers
+        if _answers is self:
+            _answers = self._previous
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def answers(source, quiet: bool = False):
+    """Answer prompts from `source` instead of stdin. Turns on for the rest of the program, or for a `with` block.
+
+    Args:
+        source: iterable or dict. Answers in order, like a list or an open file with one answer per line. Or a dict of question -> answer, the question being the text of the latest `ask()` (`get_input(question)` asks it). A question asked again, or a menu taking several answers, takes them from a list in order.
+        quiet: bool. Do not render the prompts, menus and their error messages.
+
+    Returns:
+        _Answers: Call `stop()` to go back to stdin. A prompt raises EOFError when there is no answer left for it, as `input()` does at the end of stdin. `pause()` continues without taking an answer.
+    """
+    return _Answers(source, quiet).start()
+
+
+def _prompt(steps):
+    """Run prompt steps: every `yield` in `steps` is sent a line from `input()`, after held output is flushed.
+
+    Returns:
+        The return value of `steps`.
+    """
+    flush()
+    if _answers is not None:
+        return _answers.run(steps)
+    try:
+        next(steps)
+        while True:
+            flush()
+            steps.send(_input())
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close()
+
+
+def _pause_steps(msg: str):
+    with _get_console().status(f"[pause]{escape(msg)}", spinner="point", spinner_style="pause"):
+        yield _NO_ANSWER
+    return sys.modules[__name__]  # chaining
+
+
 def pause(msg="Press [Enter] to Continue..."):
     """press to continue"""
-    with console.status(f"[pause]{escape(msg)}", spinner="point", spinner_style="pause"):
-        input()
-    return sys.modules[__name__]  # chaining
+    return _prompt(_pause_steps(msg))
 
 
 def bye(message: str = "", error: bool = False):
@@ -237,22 +1297,14 @@ def bye(message: str = "", error: bool = False):
         exit(0)
 
 
-def get_input(question: str = "", prompt: str = "> ", default: str = "", strip: bool = True) -> str:
-    """Get user input in stdin.
-
-    Args:
-        question: str. The question asked before get the answer.
-        prompt: str. The prompt shows in the same line with the input field. Always ending with a space.
-        default: str. If the answer is empty, default value returns.
-        strip: bool. Remove leading and trailing whitespaces from user input or not. Default is True.
-    """
+def _get_input_steps(question: str, prompt: str, default: str, strip: bool):
     if default:
         prompt += f"[dim]({default})[/]"
     if question:
         ask(question)
     if prompt:
-        console.print(prompt.strip(), end=" ")
-    answer = input()
+        print(prompt.strip(), end=" ")
+    answer = yield
     if strip:
         answer = answer.strip()
     if answer == "":
@@ -261,54 +1313,147 @@ def get_input(question: str = "", prompt: str = "> ", default: str = "", strip:
     return answer
 
 
-def get_choice(choices, exitable: bool = False, default: str = "") -> str:
-    """Get user choice from a given list
+def get_input(question: str = "", prompt: str = "> ", default: str = "", strip: bool = True) -> str:
+    """Get user input in stdin.
 
     Args:
-        choices: list. The list that user can choose from.
-        exitable: bool. Does `exit` is an option for user to select.
+        question: str. The question asked before get the answer.
+        prompt: str. The prompt shows in the same line with the input field. Always ending with a space.
+        default: str. If the answer is empty, default value returns.
+        strip: bool. Remove leading and trailing whitespaces from user input or not. Default is True.
     """
+    return _prompt(_get_input_steps(question, prompt, default, strip))
+
+
+CHOICE_PAGE_SIZE = 100  # menus with more choices than this are shown page by page
+
+
+class _ChoiceMenu:
+    """Paging and filtering state of a choice menu. Only the current page of the filtered choices is rendered."""
+    NEXT_WORD = ">"
+    PREV_WORD = "<"
+    FILTER_WORD = "/"
+
+    def __init__(self, choices, page_size=None):
+        self.choices = choices
+        self.page_size = CHOICE_PAGE_SIZE if page_size is None else page_size
+        self.paged = 0 < self.page_size < len(choices)  # commands are only available when paged
+        self.visible = range(len(choices))  # indexes of the choices matching the filter
+        self.query = ""
+        self.page = 0
+        self.positions = {}  # str choice -> index of its first occurrence. Other choices are picked by number only, as `1` typed for [10, 20, 1] means 10
+        for index, item in enumerate(choices):
+            if isinstance(item, str):
+                self.positions.setdefault(item, index)
+        self._prefixes = None  # sorted (casefolded str choice, index), built on the first prefix lookup
+
+    @property
+    def pages(self) -> int:
+        return max(-(-len(self.visible) // self.page_size), 1)
+
+    def window(self):
+        """Indexes of the choices on the current page."""
+        if not self.paged:
+            return self.visible
+        start = self.page * self.page_size
+        return self.visible[start:start + self.page_size]
+
+    def footer(self, bar: str) -> str:
+        if not self.paged:
+            return ""
+        found = f"{len(self.visible)} of {len(self.choices)}"
+        if self.query:
+            found += f" matching {escape(repr(self.query))}"
+        return f"{bar} [dim]Page {self.page + 1}/{self.pages} ({found}): [choice-i]{self.PREV_WORD}[/] prev, [choice-i]{self.NEXT_WORD}[/] next, [choice-i]{self.FILTER_WORD}text[/] filter[/]"
+
+    def find(self, text: str):
+        """Index of the choice named `text`, or of a typed number. None if not found."""
+        if text in self.positions:
+            return self.positions[text]
+        if text.isdigit() and 0 < int(text) <= len(self.choices):
+            return int(text) - 1
+        return None
+
+    def complete(self, text: str):
+        """Index of the only choice starting with `text`, case-insensitive. None if none or several choices match."""
+        import bisect
+
+        if not text:
+            return None
+        if self._prefixes is None:
+            self._prefixes = sorted((item.casefold(), index) for index, item in enumerate(self.choices) if isinstance(item, str))
+        key = text.casefold()
+        start = bisect.bisect_left(self._prefixes, (key,))
+        matches = [index for name, index in self._prefixes[start:start + 2] if name.startswith(key)]
+        return matches[0] if len(matches) == 1 else None
+
+    def navigate(self, text: str) -> bool:
+        """Apply a paging or filter command.
+
+        Args:
+            text: str. The user input. `>` and `<` turn the page, `/text` shows only the choices containing `text`, a lone `/` clears the filter.
+
+        Returns:
+            bool: False if `text` is not a command.
+        """
+        if not self.paged:
+            return False
+        if text == self.NEXT_WORD:
+            self.page = min(self.page + 1, self.pages - 1)
+        elif text == self.PREV_WORD:
+            self.page = max(self.page - 1, 0)
+        elif text.startswith(self.FILTER_WORD):
+            self.query = text[len(self.FILTER_WORD):].strip()
+            needle = self.query.casefold()
+            self.visible = [index for index, item in enumerate(self.choices) if needle in str(item).casefold()] if needle else range(len(self.choices))
+            self.page = 0
+        else:
+            return False
+        return True
+
+
+def _get_choice_steps(choices, exitable: bool, default: str, page_size=None):
     EXIT_WORD = "exit" if "0" in choices else "0"
     DECO = f"[dim]{'--' if __ascii__ else '──'}[/]"
     BAR = "|" if __ascii__ else "│"
     CMD_TEXT = "[{color}]{icon}[/] [choice-cmd]{text}[/]"
     EXIT_TEXT = CMD_TEXT.format(color="red", icon='~' if __ascii__ else '✗', text="EXIT")
-    fill = max(len(EXIT_WORD), 2)
-    for index, item in enumerate(choices, start=1):
-        console.print(f"{BAR} [choice-i]{index:>{fill}}[/][dim])[/] [white]{item}[/]")
-    if exitable:
-        console.print(f"{BAR} [choice-i]{EXIT_WORD:>{fill}}[/][dim])[/] {DECO} {EXIT_TEXT} {DECO}")
-    user_choice = get_input(default=default).strip()
-    if exitable and user_choice == EXIT_WORD:
-        return ""
-    if user_choice in choices:
-        return user_choice
-    if user_choice.isdigit():
-        index = int(user_choice) - 1
-        if 0 <= index < len(choices):
+    fill = max(len(EXIT_WORD), len(str(len(choices))), 2)
+    menu = _ChoiceMenu(choices, page_size)
+    while True:
+        for index in menu.window():
+            print(f"{BAR} [choice-i]{index + 1:>{fill}}[/][dim])[/] [white]{choices[index]}[/]")
+        if exitable:
+            print(f"{BAR} [choice-i]{EXIT_WORD:>{fill}}[/][dim])[/] {DECO} {EXIT_TEXT} {DECO}")
+        if menu.paged:
+            print(menu.footer(BAR))
+        user_choice = (yield from _get_input_steps("", "> ", default, True)).strip()
+        if exitable and user_choice == EXIT_WORD:
+            return ""
+        index = menu.find(user_choice)
+        if index is None and not menu.navigate(user_choice):
+            if user_choice != EXIT_WORD:  # command words are never prefixes
+                index = menu.complete(user_choice)
+            if index is None:
+                err("Please enter a valid choice.")
+        if index is not None:
             return choices[index]
-    err("Please enter a valid choice.")
-    return get_choice(choices, exitable, default)
 
 
-def get_choices(choices, allable: bool = False, exitable: bool = False) -> list:
-    """Get user choices from a given iterable.
+def get_choice(choices, exitable: bool = False, default: str = "", page_size: int = None) -> str:
+    """Get user choice from a given list
 
     Args:
-        choices: iterable. The list that user can choose from. Note: `choices` implicitly converted to a list.
-        allable: bool. Does `all` is an option for user to select.
+        choices: list. The list that user can choose from.
         exitable: bool. Does `exit` is an option for user to select.
+        page_size: int. Choices shown per page, `CHOICE_PAGE_SIZE` if None, 0 to show all. A paged menu accepts `>`, `<` to turn the page and `/text` to filter.
 
-    Returns:
-        list: A list of user choices. If user select `exit` with no choices, an empty list is returned.
+    The user can enter a number, a choice, or the start of a choice if only one choice starts with it.
     """
-    def toggle_listitem(itm, lst: list):
-        if itm in lst:
-            lst.remove(itm)
-        else:
-            lst.append(itm)
-        return lst
+    return _prompt(_get_choice_steps(choices, exitable, default, page_size))
 
+
+def _get_choices_steps(choices, allable: bool, exitable: bool, page_size=None):
     if not choices:
         raise ValueError("Choices cannot be empty.")
     choices = list(choices)  # ensure choices is a list
@@ -322,60 +1467,687 @@ def get_choices(choices, allable: bool = False, exitable: bool = False) -> list:
     ALL_TEXT = CMD_TEXT.format(color="yellow", icon='+' if __ascii__ else '❍', text="ALL")
     EXIT_TEXT = CMD_TEXT.format(color="red", icon='~' if __ascii__ else '✗', text="EXIT")
     DONE_TEXT = CMD_TEXT.format(color="green", icon='=' if __ascii__ else '✓', text="DONE")
-    fill = max(len(EXIT_WORD), len(DONE_WORD), len(ALL_WORD), 2)
-    user_choices = []
+    MARK_ON = BRACKET_WORD.format(f"[bright_green]{'+' if __ascii__ else '✓'}[/]")
+    MARK_OFF = BRACKET_WORD.format(" ")
+    fill = max(len(EXIT_WORD), len(DONE_WORD), len(ALL_WORD), len(str(len(choices))), 2)
+    menu = _ChoiceMenu(choices, page_size)
+    selected = {}  # indexes of the selected choices, a dict keeps the selection order
     while True:
         if allable:
-            console.print(f"{BAR_WORD} [choice-i]{ALL_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {ALL_TEXT} {DECO_WORD}")
-        for index, item in enumerate(choices, start=1):
-            mark = BRACKET_WORD.format(f"[bright_green]{'+' if __ascii__ else '✓'}[/]") if item in user_choices else BRACKET_WORD.format(" ")  # item is selected or not
-            console.print(f"{BAR_WORD} [choice-i]{index:>{fill}}[/][dim])[/] {mark} [white]{item}")
-        if user_choices:  # user selections > 0
-            console.print(f"{BAR_WORD} [choice-i]{DONE_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {DONE_TEXT} {DECO_WORD}")
+            print(f"{BAR_WORD} [choice-i]{ALL_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {ALL_TEXT} {DECO_WORD}")
+        for index in menu.window():
+            mark = MARK_ON if index in selected else MARK_OFF
+            print(f"{BAR_WORD} [choice-i]{index + 1:>{fill}}[/][dim])[/] {mark} [white]{choices[index]}")
+        if selected:  # user selections > 0
+            print(f"{BAR_WORD} [choice-i]{DONE_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {DONE_TEXT} {DECO_WORD}")
         elif exitable:  # no user selection, but exitable is on.
-            console.print(f"{BAR_WORD} [choice-i]{EXIT_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {EXIT_TEXT} {DECO_WORD}")
-        user_choice = get_input().strip()
+            print(f"{BAR_WORD} [choice-i]{EXIT_WORD:>{fill}}[/][dim])[/] {DECO_WORD} {EXIT_TEXT} {DECO_WORD}")
+        if menu.paged:
+            print(menu.footer(BAR_WORD))
+        user_choice = (yield from _get_input_steps("", "> ", "", True)).strip()
         if (user_choice == DONE_WORD or user_choice == EXIT_WORD or user_choice == ""):
-            if exitable or len(user_choices) > 0:  # keep looping when not exitable and no user choices.
-                return user_choices
-        if allable and user_choice == ALL_WORD:
-            if len(user_choices) == len(choices):
-                user_choices = []
+            if exitable or selected:  # keep looping when not exitable and no user choices.
+                return [choices[index] for index in selected]
+        if allable and user_choice == ALL_WORD:  # toggle all the choices matching the filter
+            if all(index in selected for index in menu.visible):
+                for index in menu.visible:
+                    selected.pop(index, None)
             else:
-                user_choices = choices.copy()
-        elif user_choice in choices:
-            user_choices = toggle_listitem(user_choice, user_choices)
-        elif user_choice.isdigit() and 0 < int(user_choice) <= len(choices):
-            index = int(user_choice) - 1
-            user_choices = toggle_listitem(choices[index], user_choices)
+                selected = dict.fromkeys(sorted({*selected, *menu.visible}))
         else:
-            err("Please enter a valid choice.")
+            index = menu.find(user_choice)
+            if index is None and not menu.navigate(user_choice):
+                if user_choice not in (ALL_WORD, DONE_WORD, EXIT_WORD):  # command words are never prefixes
+                    index = menu.complete(user_choice)
+                if index is None:
+                    err("Please enter a valid choice.")
+            if index is not None and selected.pop(index, False) is False:
+                selected[index] = None
 
 
-def track(iterable, desc="", unit="", *args, **options):
-    with rich.progress.Progress("|" if __ascii__ else "│", rich.progress.SpinnerColumn(), *rich.progress.Progress.get_default_columns(), "·", rich.progress.MofNCompleteColumn(), unit, *args, **options) as progress:
-        task = progress.add_task(desc, total=None if not iterable or not len(iterable) else len(iterable))
-        while not progress.finished:
-            for item in iterable:
-                yield item
-                progress.update(task, advance=1)
+def get_choices(choices, allable: bool = False, exitable: bool = False, page_size: int = None) -> list:
+    """Get user choices from a given iterable.
+
+    Args:
+        choices: iterable. The list that user can choose from. Note: `choices` implicitly converted to a list.
+        allable: bool. Does `all` is an option for user to select. When filtered, `all` toggles the matching choices only.
+        exitable: bool. Does `exit` is an option for user to select.
+        page_size: int. Choices shown per page, `CHOICE_PAGE_SIZE` if None, 0 to show all. A paged menu accepts `>`, `<` to turn the page and `/text` to filter.
+
+    The user can enter a number, a choice, or the start of a choice if only one choice starts with it.
+
+    Returns:
+        list: A list of user choices. If user select `exit` with no choices, an empty list is returned.
+    """
+    return _prompt(_get_choices_steps(choices, allable, exitable, page_size))
+
+
+async def aflush():
+    """Awaitable `flush()`. Waits for queued output in a worker thread, so the event loop keeps running."""
+    import asyncio
+
+    await asyncio.get_running_loop().run_in_executor(None, flush)
+    return sys.modules[__name__]  # chaining
+
+
+_pending_input = None  # concurrent.futures.Future of an input() line not yet taken by _ainput()
+
+
+async def _ainput() -> str:
+    """Line from `input()`, read in a daemon thread so the event loop keeps running.
+
+    If the awaiting task is cancelled, the line is kept for the next caller instead of being lost.
+    """
+    import asyncio
+    import concurrent.futures
+
+    global _pending_input
+    if _pending_input is None:
+        future = concurrent.futures.Future()
+        future.set_running_or_notify_cancel()  # a read in progress cannot be cancelled
+
+        def read():
+            try:
+                future.set_result(input())
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=read, name="consoleiotools-input", daemon=True).start()
+        _pending_input = future
+    future = _pending_input
+    try:
+        return await asyncio.wrap_future(future)
+    finally:
+        if future.done() and _pending_input is future:
+            _pending_input = None
+
+
+async def _aprompt(steps):
+    """Awaitable `_prompt()`: lines are read by `_ainput()` and output is flushed by `aflush()`."""
+    await aflush()
+    if _answers is not None:
+        return _answers.run(steps)
+    try:
+        next(steps)
+        while True:
+            await aflush()
+            t = time.perf_counter()
+            line = await _ainput()
+            profile = _profile
+            if profile is not None:
+                profile.add_input(time.perf_counter() - t)
+            steps.send(line)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close()
+
+
+async def apause(msg="Press [Enter] to Continue..."):
+    """Awaitable `pause()`. Waits without blocking the event loop."""
+    return await _aprompt(_pause_steps(msg))
+
+
+async def aget_input(question: str = "", prompt: str = "> ", default: str = "", strip: bool = True) -> str:
+    """Awaitable `get_input()`. Waits for the answer without blocking the event loop."""
+    return await _aprompt(_get_input_steps(question, prompt, default, strip))
+
+
+async def aget_choice(choices, exitable: bool = False, default: str = "", page_size: int = None) -> str:
+    """Awaitable `get_choice()`. Waits for the answer without blocking the event loop."""
+    return await _aprompt(_get_choice_steps(choices, exitable, default, page_size))
+
+
+async def aget_choices(choices, allable: bool = False, exitable: bool = False, page_size: int = None) -> list:
+    """Awaitable `get_choices()`. Waits for the answers without blocking the event loop."""
+    return await _aprompt(_get_choices_steps(choices, allable, exitable, page_size))
+
+
+_TRACK_MAX_STEP = 64  # most items between clock reads, bounds how stale the bar gets when items slow down
+
+
+def _tracked(progress, task, iterable, update_period: float, size=None):
+    """Yield from `iterable`, counting progress locally and pushing it to `task` at most every `update_period` seconds.
+
+    The clock is only read every `step` items, a step rescaled from the measured rate to about half of `update_period`. The final count is always pushed.
+
+    Args:
+        size: callable. Amount an item advances the task by. Defaults to 1 per item.
+    """
+    completed = items = 0
+    step = check_at = 1
+    last_update = last_check = time.monotonic()
+    try:
+        for item in iterable:
+            yield item
+            items += 1
+            completed += 1 if size is None else size(item)
+            if items >= check_at:
+                now = time.monotonic()
+                if now - last_update >= update_period:
+                    progress.update(task, completed=completed)
+                    last_update = now
+                step = max(1, min(_TRACK_MAX_STEP, int(step * update_period / (2 * max(now - last_check, 1e-9)))))
+                last_check = now
+                check_at = items + step
+    finally:
+        progress.update(task, completed=completed)
+
+
+def progress(*columns, **options):
+    """A `rich.progress.Progress` with the columns of `track()`. Start it with `with` to share one display among several `track_map()`.
+
+    Args:
+        *columns: Extra columns after the default ones.
+        **options: Passed to `rich.progress.Progress`.
+    """
+    import rich.progress
+
+    return rich.progress.Progress("|" if __ascii__ else "│", rich.progress.SpinnerColumn(), *rich.progress.Progress.get_default_columns(), "·", rich.progress.MofNCompleteColumn(), *columns, **options)
 
 
-def read_file(path: str, with_encoding: bool = False, **kwargs) -> tuple[str, str] | str:
-    for enc in ("utf-8", "gbk", "cp1252", "windows-1252", "latin-1"):
+def track(iterable, desc="", unit="", *args, total: int = None, update_period: float = 0.1, **options):
+    """Show a progress bar while iterating. Works with any iterable, including generators, which are never materialized.
+
+    Args:
+        total: int. Number of items. Guessed with `operator.length_hint()` if not given, else the bar shows no total.
+        update_period: float. Seconds between pushes of the count to the bar.
+    """
+    import operator
+
+    if total is None:
+        total = operator.length_hint(iterable, 0) or None
+    with progress(unit, *args, **options) as bars:
+        task = bars.add_task(desc, total=total)
+        yield from _tracked(bars, task, iterable, update_period)
+
+
+def track_bytes(fileobj, total_bytes: int = None, desc="", chunk_size: int = 64 * 1024, *args, update_period: float = 0.1, **options):
+    """Read a binary file object in chunks, showing bytes read and throughput.
+
+    Args:
+        fileobj: file object. Read from its current position.
+        total_bytes: int. Bytes to be read. The rest of the file's size if not given, when it can be known.
+        chunk_size: int. Bytes read at a time.
+
+    Yields:
+        bytes: Each chunk read.
+    """
+    import rich.progress
+
+    if total_bytes is None:
+        try:
+            total_bytes = os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+
+    def chunks():
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    with rich.progress.Progress("|" if __ascii__ else "│", rich.progress.SpinnerColumn(), rich.progress.TextColumn("[progress.description]{task.description}"), rich.progress.BarColumn(), rich.progress.DownloadColumn(), "·", rich.progress.TransferSpeedColumn(), rich.progress.TimeRemainingColumn(), *args, **options) as progress:
+        task = progress.add_task(desc, total=total_bytes)
+        yield from _tracked(progress, task, chunks(), update_period, size=len)
+
+
+def track_map(func, iterable, workers: int = 8, executor: str = "thread", ordered: bool = True, desc="", unit="", total: int = None, display=None, **options):
+    """Call `func` on each item in parallel, with one progress bar advanced by the main thread as calls finish.
+
+    At most `workers` * 2 calls are queued or waiting for their turn to be yielded at a time, so `iterable` is consumed lazily.
+    An exception raised by `func` is raised here, and the calls not started yet are cancelled.
+
+    Args:
+        workers: int. Calls running at the same time.
+        executor: str. "thread", or "process" for CPU-bound work, then `func` and items must be picklable.
+        ordered: bool. Yield results in the order of `iterable`, or else as soon as each call finishes.
+        total: int. Number of items. Guessed with `operator.length_hint()` if not given.
+        display: rich.progress.Progress. A started display from `progress()` to add this bar to, instead of a display of its own.
+        **options: Passed to `progress()` for a display of its own.
+
+    Yields:
+        The result of each call.
+    """
+    import concurrent.futures
+    import contextlib
+    import itertools
+    import operator
+
+    if total is None:
+        total = operator.length_hint(iterable, 0) or None
+    if executor == "thread":
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    elif executor == "process":
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"executor must be 'thread' or 'process', not {executor!r}.")
+    items = iter(iterable)
+    in_order = collections.deque()  # submitted calls not yielded yet, oldest first
+    pending = set()  # submitted calls not finished yet
+    completed = 0
+    try:
+        with contextlib.nullcontext(display) if display is not None else progress(unit, **options) as bars:
+            task = bars.add_task(desc, total=total)
+            while True:
+                for item in itertools.islice(items, workers * 2 - len(in_order)):  # finished calls behind a slow one count too
+                    future = pool.submit(func, item)
+                    in_order.append(future)
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                completed += len(done)
+                bars.update(task, completed=completed)
+                if ordered:
+                    while in_order and in_order[0].done():
+                        yield in_order.popleft().result()
+                else:
+                    for future in done:
+                        in_order.remove(future)
+                        yield future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+_ENCODINGS = ("utf-8", "gbk", "cp1252", "windows-1252", "latin-1")  # tried in order when reading files
+
+
+def _detect_encoding(sample: bytes, final: bool = True, errors: str = "strict") -> str:
+    """First encoding in `_ENCODINGS` that decodes `sample`.
+
+    Args:
+        sample: bytes. The whole file, or its beginning if `final` is False.
+        final: bool. If False, a multibyte character cut off at the end of `sample` is not an error.
+        errors: str. Error handler used for decoding, as in `open()`.
+    """
+    for enc in _ENCODINGS:
         try:
-            with open(path, mode="r", encoding=enc, **kwargs) as f:
-                return (f.read(), enc) if with_encoding else f.read()
+            codecs.getincrementaldecoder(enc)(errors).decode(sample, final=final)
+            return enc
         except UnicodeDecodeError:
             pass
-    return ("", "") if with_encoding else ""
+    return ""
+
+
+def _text_decoder(encoding: str):
+    """Incremental decoder with the universal newlines translation of text mode `open()`."""
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+
+
+FILE_CACHE_SIZE = 256  # files whose encoding (and memoized content) read_file() remembers
+_file_cache = collections.OrderedDict()  # (path, mtime_ns, size, errors, newline) -> [encoding, content or None], least recent first
+_file_cache_stats = {"hits": 0, "misses": 0}
+_file_cache_lock = threading.Lock()
+
+
+def file_cache_info() -> dict:
+    """Hits, misses and size of the `read_file()` cache."""
+    with _file_cache_lock:
+        return dict(_file_cache_stats, maxsize=FILE_CACHE_SIZE, currsize=len(_file_cache))
+
+
+def file_cache_clear():
+    """Empty the `read_file()` cache and reset its stats."""
+    with _file_cache_lock:
+        _file_cache.clear()
+        _file_cache_stats.update(hits=0, misses=0)
+
+
+_OPEN_KWARGS = ("buffering", "closefd", "opener")  # read_file() kwargs for `open()`, `errors` and `newline` are for decoding
+
+
+def _decode(data: bytes, encodings=_ENCODINGS, errors: str = "strict") -> tuple[str, str]:
+    """Text and encoding of `data`, decoded by the first of `encodings` that works, or ("", "") if none does."""
+    for enc in encodings:
+        try:
+            return data.decode(enc, errors), enc
+        except UnicodeDecodeError:
+            pass
+    return "", ""
+
 
+def read_file(path: str, with_encoding: bool = False, memoize: bool = False, **kwargs) -> tuple[str, str] | str:
+    """Read a text file, trying utf-8, gbk, cp1252, windows-1252 and latin-1 in turn.
 
-def write_file(path: str, content: str, overwrite: bool = False, **kwargs):
+    The working encoding is cached per file, keyed on its path, modification time and size, so repeat reads skip detection.
+    The file is read and decoded once, newlines are translated like text mode `open()` does.
+
+    Args:
+        path: str. The file to read.
+        with_encoding: bool. Return a tuple of (content, encoding).
+        memoize: bool. Also cache the content, and return it while the file stays unchanged.
+        **kwargs: `errors` and `newline` as in `open()`, and `buffering`, `closefd` and `opener`, passed to `open()`.
+    """
+    open_kwargs = {name: kwargs.pop(name) for name in _OPEN_KWARGS if name in kwargs}
+    errors = kwargs.pop("errors", None) or "strict"
+    newline = kwargs.pop("newline", None)
+    if kwargs:
+        raise TypeError(f"read_file() got unexpected keyword arguments: {', '.join(kwargs)}")
+    if newline not in (None, "", "\n", "\r", "\r\n"):
+        raise ValueError(f"illegal newline value: {newline!r}")
+    with open(path, mode="rb", **open_kwargs) as f:
+        stat = os.fstat(f.fileno())
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, errors, newline)
+        with _file_cache_lock:
+            entry = _file_cache.get(key)
+            if entry:
+                _file_cache.move_to_end(key)
+                _file_cache_stats["hits"] += 1
+            else:
+                _file_cache_stats["misses"] += 1
+        if entry and entry[1] is not None:
+            return (entry[1], entry[0]) if with_encoding else entry[1]
+        data = f.read()  # read once, then decode in memory
+    content, enc = _decode(data, (entry[0],), errors) if entry else ("", "")
+    if not enc:  # not known, or changed within the same mtime and size: detect
+        content, enc = _decode(data, errors=errors)
+    if not enc:
+        return ("", "") if with_encoding else ""
+    if newline is None and "\r" in content:  # universal newlines
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    with _file_cache_lock:
+        _file_cache[key] = [enc, content if memoize else None]
+        _file_cache.move_to_end(key)
+        while len(_file_cache) > FILE_CACHE_SIZE:
+            _file_cache.popitem(last=False)
+    return (content, enc) if with_encoding else content
+
+
+def _read_file_result(path: str, with_encoding: bool, kwargs: dict) -> tuple:
+    """One result of `read_files()`, a module-level function so process pools can pickle it."""
+    try:
+        return path, read_file(path, with_encoding=with_encoding, **kwargs), None
+    except Exception as e:
+        return path, None, e
+
+
+def read_files(paths, workers: int = 8, with_encoding: bool = False, ordered: bool = True, executor: str = "thread", show_progress: bool = False, **kwargs):
+    """Read many text files in parallel with `read_file()`, through `track_map()`. A file that fails does not stop the others.
+
+    Paths are taken from `paths` as workers free up, so a long or endless iterable is fine.
+
+    Args:
+        paths: iterable. The files to read.
+        workers: int. Files read at the same time.
+        with_encoding: bool. Results are tuples of (content, encoding).
+        ordered: bool. Yield in the order of `paths`, or else as soon as each file is read.
+        executor: str. "thread", or "process" for decode-heavy loads. Each process has its own encoding cache.
+        show_progress: bool. Show a progress bar.
+        **kwargs: Passed to `read_file()`.
+
+    Yields:
+        tuple: (path, result, error). `result` is what `read_file()` returns, or None if `error`, the exception raised, is set.
+    """
+    import functools
+
+    func = functools.partial(_read_file_result, with_encoding=with_encoding, kwargs=kwargs)
+    yield from track_map(func, paths, workers=workers, executor=executor, ordered=ordered, desc="Reading", unit="files", disable=not show_progress)
+
+
+def iter_file(path: str, chunk_size: int = 64 * 1024, sample_size: int = 64 * 1024):
+    """Read a text file lazily, yielding decoded chunks. The file is read once and never held in memory as a whole.
+
+    The encoding is detected from the first `sample_size` bytes, trying the same encodings as `read_file()`.
+    If a later chunk does not decode, the rest of the file continues with the next encoding that does, from that chunk on.
+
+    Args:
+        path: str. The file to read.
+        chunk_size: int. Bytes read at a time after the sample.
+        sample_size: int. Bytes used to detect the encoding.
+
+    Yields:
+        str: Decoded text, newlines translated to `\\n` like `read_file()`.
+    """
+    with open(path, mode="rb") as f:
+        data = f.read(sample_size)
+        final = len(data) < sample_size
+        encodings = list(_ENCODINGS[_ENCODINGS.index(_detect_encoding(data, final=final)):])
+        decoder = _text_decoder(encodings[0])
+        while True:
+            state = decoder.getstate()  # undecoded bytes so far, some decoders lose them on errors
+            try:
+                text = decoder.decode(data, final=final)
+            except UnicodeDecodeError:
+                if len(encodings) == 1:
+                    raise
+                encodings.pop(0)
+                pending, flag = state
+                decoder = _text_decoder(encodings[0])
+                decoder.setstate((b"", flag & 1))  # keep a pending \r
+                data = pending + data
+                continue
+            if text:
+                yield text
+            if final:
+                return
+            data = f.read(chunk_size)
+            final = not data
+
+
+def iter_lines(path: str, chunk_size: int = 64 * 1024):
+    """Read a text file lazily, line by line. See `iter_file()`.
+
+    Yields:
+        str: Each line, ending with `\\n` except maybe the last one.
+    """
+    parts = []  # pieces of the current unfinished line
+    for chunk in iter_file(path, chunk_size=chunk_size):
+        *lines, last = chunk.split("\n")
+        if lines:
+            lines[0] = "".join(parts) + lines[0]
+            parts.clear()
+            for line in lines:
+                yield line + "\n"
+        if last:
+            parts.append(last)
+    if parts:
+        yield "".join(parts)
+
+
+class MappedFile:
+    """A text file mapped into memory by `map_file()`.
+
+    The bytes are shared with the OS page cache through `data`, a memoryview, and only decoded by slice on demand.
+    Line offsets are indexed lazily, only as far as the lines asked for. Lines are split on `\\n`.
+    """
+
+    def __init__(self, path: str, encoding: str = "", errors: str = "strict", sample_size: int = 64 * 1024):
+        import array
+        import mmap
+
+        self.path = path
+        self.errors = errors
+        with open(path, mode="rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        self.data = memoryview(self._mmap if self._mmap is not None else b"")
+        if not encoding:
+            sample = self.data[:sample_size]
+            encoding = _detect_encoding(sample, final=len(sample) == len(self.data))
+        self.encoding = encoding
+        self._line_starts = array.array("q", [0])  # byte offset of each line found so far
+        self._scanned = 0  # bytes indexed so far
+        self._indexed = len(self.data) == 0  # True once the whole file is indexed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def close(self):
+        """Unmap the file. Slices taken from `data` must be released first."""
+        self.data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def _index_to(self, lineno: int):
+        """Index line starts, a block at a time, until line `lineno` is found or the file ends."""
+        import itertools
+        import operator
+
+        starts = self._line_starts
+        while not self._indexed and len(starts) <= lineno + 1:
+            pos = self._scanned
+            block = self._mmap[pos:pos + 1024 * 1024]
+            lengths = map(operator.add, map(len, block.split(b"\n")[:-1]), itertools.repeat(1))  # each part ends with \n
+            starts.extend(itertools.islice(itertools.accumulate(lengths, initial=pos), 1, None))
+            self._scanned = pos + len(block)
+            self._indexed = self._scanned >= len(self.data)
+
+    @property
+    def line_count(self) -> int:
+        """Number of lines. Indexes the whole file on first use."""
+        self._index_to(sys.maxsize)
+        starts = self._line_starts
+        return len(starts) if starts[-1] < len(self.data) else len(starts) - 1
+
+    def text(self, start: int = 0, stop: int = None) -> str:
+        """Decode bytes `start` to `stop`."""
+        return str(self.data[start:stop], self.encoding, self.errors)
+
+    def line(self, lineno: int) -> str:
+        """Line number `lineno`, counting from 0, without its line ending."""
+        self._index_to(lineno)
+        starts = self._line_starts
+        if lineno < 0 or lineno >= len(starts) or starts[lineno] >= len(self.data):
+            raise IndexError(f"line {lineno} out of range")
+        end = starts[lineno + 1] if lineno + 1 < len(starts) else len(self.data)
+        line = self.text(starts[lineno], end)
+        return line[:-2] if line.endswith("\r\n") else line.rstrip("\n")
+
+    def lines(self, start: int = 0, stop: int = None) -> list:
+        """Lines `start` to `stop`, counting from 0, without their line endings."""
+        if stop is None:
+            stop = self.line_count
+        self._index_to(stop)
+        if self._indexed:
+            stop = min(stop, self.line_count)
+        return [self.line(lineno) for lineno in range(start, stop)]
+
+
+def map_file(path: str, encoding: str = "", errors: str = "strict") -> MappedFile:
+    """Map a text file into memory, for random access to large files without reading them.
+
+    Args:
+        path: str. The file to map.
+        encoding: str. Detected from the start of the file like `read_file()` if empty.
+        errors: str. Error handler used for decoding, as in `open()`.
+
+    Returns:
+        MappedFile: Use as a context manager, or `close()` it.
+    """
+    return MappedFile(path, encoding=encoding, errors=errors)
+
+
+def write_file(path: str, content, overwrite: bool = False, **kwargs):
+    """Write text to a file, appending unless `overwrite`.
+
+    Args:
+        content: str or iterable of str. An iterable is written piece by piece, without joining it first.
+
+    Returns:
+        int: Characters written.
+    """
     mode = "w" if overwrite else "a"
     with open(path, mode=mode, encoding="utf-8", **kwargs) as fl:
-        return fl.write(content)
+        if isinstance(content, str):
+            return fl.write(content)
+        return sum(map(fl.write, content))
+
+
+class FileWriter:
+    """An open text file from `open_writer()`, for many writes without reopening.
+
+    In atomic mode everything goes to a temporary file next to `path`, which replaces `path` on `close()`.
+    Readers see the old content or the new one, never a partial write. Leaving a `with` block on an exception discards the writes.
+    """
+
+    def __init__(self, path: str, overwrite: bool = False, buffer_size: int = 1024 * 1024, atomic: bool = False, **kwargs):
+        import shutil
+
+        self.path = path
+        self.atomic = atomic
+        self.written = 0  # characters written so far
+        mode = "w" if overwrite else "a"
+        self._tmp_path = f"{path}.{os.getpid()}.{id(self):x}.tmp" if atomic else ""
+        existed = atomic and os.path.exists(path)
+        if existed and not overwrite:
+            shutil.copyfile(path, self._tmp_path)  # appending starts from the current content
+        self._file = open(self._tmp_path or path, mode=mode, encoding="utf-8", buffering=buffer_size, **kwargs)
+        if existed:
+            shutil.copymode(path, self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.atomic:
+            self.discard()
+        else:
+            self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def write(self, content: str) -> int:
+        count = self._file.write(content)
+        self.written += count
+        return count
+
+    def writelines(self, lines) -> int:
+        """Write an iterable of strings. Line endings are not added.
+
+        Returns:
+            int: Characters written.
+        """
+        count = sum(map(self._file.write, lines))
+        self.written += count
+        return count
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """Flush and close the file. In atomic mode, replace `path` with what was written."""
+        if self._file.closed:
+            return
+        if self.atomic:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._file.close()
+        if self.atomic:
+            os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        """Close without replacing `path`. Only in atomic mode."""
+        if not self.atomic:
+            raise ValueError("Only atomic writers can be discarded.")
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._tmp_path)
+
+
+def open_writer(path: str, overwrite: bool = False, buffer_size: int = 1024 * 1024, atomic: bool = False, **kwargs) -> FileWriter:
+    """Open a file for many writes, flushed in large blocks.
+
+    Args:
+        path: str. The file to write, in utf-8.
+        overwrite: bool. Start from an empty file instead of appending.
+        buffer_size: int. Bytes held before they are written to the file.
+        atomic: bool. Write to a temporary file that replaces `path` on `close()`.
+        **kwargs: Passed to `open()`, e.g. `newline`.
+
+    Returns:
+        FileWriter: Use as a context manager, or `close()` it.
+    """
+    return FileWriter(path, overwrite=overwrite, buffer_size=buffer_size, atomic=atomic, **kwargs)
 
 
 if __name__ == "__main__":
-    markdown(read_file("README.md"))
+    markdown_file("README.md")
@@ -1,5 +1,3 @@
-import sys
-import io
 import time
 
 import consoleiotools as cit
@@ -16,20 +14,6 @@ def inspect(func_name, *args, **kwargs):
     return getattr(cit, func_name)(*args, **kwargs)
 
 
-class fake_input:
-    def __init__(self, user_input: str, double: bool = False):
-        self.double = double
-        self.user_input = user_input.strip().strip("\n") + "\n"
-        if double:
-            self.user_input += self.user_input
-
-    def __enter__(self):
-        sys.stdin = io.StringIO(self.user_input)
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        sys.stdin = sys.__stdin__
-
-
 def examples():
     inspect("start")
     inspect("title", "This is a title")
@@ -51,11 +35,10 @@ def examples():
     )
     inspect("br")
     inspect("rule", "This is a horizontal rule.")
-    with fake_input("Apple"):
+    with cit.answers(["Apple"]):
         result = inspect("get_input", "Get user input:")
-        print("Apple")
         print(repr(result))
-    with fake_input("1"):
+    with cit.answers(["2"]):
         result = inspect(
             "get_choice",
             [
@@ -64,9 +47,8 @@ def examples():
             ],
             exitable=True
         )
-        print("2")
         print(repr(result))
-    with fake_input("0"):
+    with cit.answers(["0"]):
         result = inspect(
             "get_choices",
             [
@@ -76,7 +58,6 @@ def examples():
             exitable=True,
             allable=True
         )
-        print("0")
         print(result)
     inspect("track", "range(10), desc='Progress', unit='unit'")
     for i in cit.track(range(10), desc="Progress", unit="unit"):
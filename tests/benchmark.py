@@ -0,0 +1,255 @@
+"""Benchmarks for consoleiotools hot paths.
+
+Run from the repo root: `python tests/benchmark.py [--json results.json]`.
+With `--json`, every measurement is also saved to compare between versions.
+Exits with code 1 if a budget check fails.
+"""
+import argparse
+import contextlib
+import importlib.metadata
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import rich.console  # noqa: E402
+
+import consoleiotools as cit  # noqa: E402
+
+IMPORT_RUNS = 15
+IMPORT_BUDGET_MS = 15  # allowed import cost on top of `import rich.console`
+ECHO_LINES = 100_000
+TTY_LINES = 10_000  # rendering with styles is much slower
+ECHO_INDENTS = (0, 1, 3)
+RENDER_CALLS = 1000
+TRACK_ITEMS = 1_000_000
+READ_SIZES = (4 * 1024, 1024 * 1024)
+READ_BYTES = 8 * 1024 * 1024  # read each file until this many bytes are read, at least READ_MIN_RUNS times
+READ_MIN_RUNS = 10
+READ_SAMPLES = {  # encoding read_file() should detect -> text that only decodes from that encoding on
+    "utf-8": "Hello wörld, 你好世界.\n",
+    "gbk": "Hello 你好世界.\n",
+    "cp1252": "Caf\xe9 “quoted” – dash.\n",
+    "latin-1": "Caf\xe9 \x81 control.\n",
+}
+APPEND_LINES = 10_000
+CHOICES = 5000
+CHOICE_REDRAWS = 20
+
+results = []  # every measurement, saved by --json
+
+
+def report(name: str, value: float, unit: str, note: str = "") -> float:
+    results.append({"name": name, "value": round(value, 3), "unit": unit})
+    print(f"{name:<40} {value:12.1f} {unit:<8} {note}".rstrip())
+    return value
+
+
+def cold_import_ms(*modules: str) -> list:
+    """Median wall time of importing each module in a fresh interpreter. Runs are interleaved to even out noise."""
+    timings = {module: [] for module in modules}
+    for _ in range(IMPORT_RUNS):
+        for module in modules:
+            code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+            out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            timings[module].append(float(out) * 1000)
+    return [statistics.median(timings[module]) for module in modules]
+
+
+def bench_import() -> bool:
+    baseline, cit_ms = cold_import_ms("rich.console", "consoleiotools")
+    overhead = cit_ms - baseline
+    ok = overhead <= IMPORT_BUDGET_MS
+    report("import rich.console", baseline, "ms")
+    report("import consoleiotools", cit_ms, "ms", f"({overhead:+.1f} ms, budget +{IMPORT_BUDGET_MS} ms) {'OK' if ok else 'OVER BUDGET'}")
+    return ok
+
+
+def plain_console() -> rich.console.Console:
+    """A console writing to memory, as if stdout was piped to a file."""
+    return rich.console.Console(file=io.StringIO(), theme=cit.theme, width=120)
+
+
+def tty_console() -> rich.console.Console:
+    """A console writing to memory, styled as if stdout was a terminal."""
+    return rich.console.Console(file=io.StringIO(), theme=cit.theme, width=120, force_terminal=True, color_system="truecolor")
+
+
+def lines_per_sec(func, lines: int = ECHO_LINES, console=None) -> float:
+    cit.console = console or plain_console()
+    t = time.perf_counter()
+    for i in range(lines):
+        func(i)
+    return lines / (time.perf_counter() - t)
+
+
+def bench_echo() -> bool:
+    rich_rate = report("info() plain sink via rich", lines_per_sec(lambda i: cit.info("Processed item", i, end="\n")), "lines/s")  # options skip the plain fast path
+    for indent in ECHO_INDENTS:
+        rate = report(f"info() plain sink, indent {indent}", lines_per_sec(lambda i: cit.info("Processed item", i, indent=indent)), "lines/s")
+        if indent == 0:
+            print(f"{'':<40} {rate / rich_rate:11.1f}x plain path")
+    for indent in ECHO_INDENTS:
+        report(f"info() tty sink, indent {indent}", lines_per_sec(lambda i: cit.info("Processed item", i, indent=indent), TTY_LINES, tty_console()), "lines/s")
+    report("echo() tty sink, markup", lines_per_sec(lambda i: cit.echo("[b]Processed[/] item", i), TTY_LINES, tty_console()), "lines/s")
+    return True
+
+
+class CountingFile:
+    """Proxy to a real file counting write and flush calls, each one a syscall."""
+
+    def __init__(self, file):
+        self.file = file
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def write(self, text):
+        self.calls += 1
+        return self.file.write(text)
+
+    def flush(self):
+        self.calls += 1
+        return self.file.flush()
+
+
+def bench_buffered() -> bool:
+    for name, context in (("unbuffered", contextlib.nullcontext), ("buffered()", cit.buffered)):
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as file:
+            sink = CountingFile(file)
+            cit.console = rich.console.Console(file=sink, theme=cit.theme, width=120)
+            t = time.perf_counter()
+            with context():
+                for i in range(ECHO_LINES):
+                    cit.info("Processed item", i)
+            rate = ECHO_LINES / (time.perf_counter() - t)
+        report(f"info() to file, {name}", rate, "lines/s", f"{sink.calls} write/flush calls")
+        report(f"info() to file, {name} syscalls", sink.calls, "calls")
+    return True
+
+
+def us_per_call(func, calls: int = RENDER_CALLS) -> float:
+    func()  # warm up imports and caches
+    t = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - t) / calls * 1e6
+
+
+def bench_render() -> bool:
+    cit.console = tty_console()
+    report("title() tty sink", us_per_call(lambda: cit.title("Session name")), "us/call")
+    report("panel() tty sink", us_per_call(lambda: cit.panel("Hello World\nSecond line", title="Title")), "us/call")
+    report("rule() tty sink", us_per_call(lambda: cit.rule("Section")), "us/call")
+    doc = "# Header\n\nSome *text* with `code`.\n\n- one\n- two"
+    report("markdown() tty sink, uncached", us_per_call(lambda: (cit.markdown_cache_clear(), cit.markdown(doc))), "us/call")
+    report("markdown() tty sink, cached", us_per_call(lambda: cit.markdown(doc)), "us/call")
+    report("markdown_file() README.md", us_per_call(lambda: cit.markdown_file(os.path.join(ROOT, "README.md")), 20), "us/call")
+    return True
+
+
+def loop_ns(iterable) -> float:
+    """Nanoseconds per item of an empty loop over `iterable`."""
+    t = time.perf_counter()
+    for _ in iterable:
+        pass
+    return (time.perf_counter() - t) / TRACK_ITEMS * 1e9
+
+
+def bench_track() -> bool:
+    bare = report("bare loop", loop_ns(range(TRACK_ITEMS)), "ns/item")
+    report("track() update every item", loop_ns(cit.track(range(TRACK_ITEMS), update_period=0, disable=True)) - bare, "ns/item", "overhead")  # one update per item
+    report("track() throttled", loop_ns(cit.track(range(TRACK_ITEMS), disable=True)) - bare, "ns/item", "overhead")
+    return True
+
+
+def read_uncached(path: str) -> str:
+    """read_file() with the encoding cache cleared, so all encodings before the right one are tried."""
+    cit.file_cache_clear()
+    return cit.read_file(path)
+
+
+def bench_read_file() -> bool:
+    with tempfile.TemporaryDirectory() as folder:
+        for encoding, sample in READ_SAMPLES.items():
+            for size in READ_SIZES:
+                path = os.path.join(folder, f"{encoding}-{size}.txt")
+                data = sample.encode(encoding)
+                with open(path, "wb") as f:
+                    f.write(data * (size // len(data) + 1))
+                _, detected = cit.read_file(path, with_encoding=True)
+                assert detected == encoding, f"{path} read as {detected}"
+                runs = max(READ_BYTES // size, READ_MIN_RUNS)
+                report(f"read_file() {encoding} {size // 1024} KiB", us_per_call(lambda: read_uncached(path), runs), "us/read")
+                report(f"read_file() {encoding} {size // 1024} KiB, known enc", us_per_call(lambda: cit.read_file(path), runs), "us/read")
+    return True
+
+
+def bench_write_file() -> bool:
+    line = "Processed item 123456\n"
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "append.txt")
+        report("write_file() append loop", 1e6 / us_per_call(lambda: cit.write_file(path, line), APPEND_LINES), "lines/s")
+        with cit.open_writer(os.path.join(folder, "writer.txt")) as writer:
+            report("open_writer() write loop", 1e6 / us_per_call(lambda: writer.write(line), APPEND_LINES), "lines/s")
+    return True
+
+
+def bench_get_choices() -> bool:
+    choices = [f"host-{i:05d}.example.com" for i in range(CHOICES)]
+    answers = [str(i) for i in range(1, CHOICE_REDRAWS)] + ["0"]  # a redraw after each answer
+    for name, page_size in (("paged", None), ("all shown", 0)):
+        cit.console = plain_console()
+        t = time.perf_counter()
+        with cit.answers(answers):
+            cit.get_choices(choices, page_size=page_size)
+        report(f"get_choices() x{CHOICES} {name}", (time.perf_counter() - t) / len(answers) * 1000, "ms/redraw")
+    return True
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "echo": bench_echo,
+    "buffered": bench_buffered,
+    "render": bench_render,
+    "track": bench_track,
+    "read_file": bench_read_file,
+    "write_file": bench_write_file,
+    "get_choices": bench_get_choices,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name", help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--json", metavar="PATH", help="also save the results to a JSON file")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    ok = all([BENCHMARKS[name]() for name in args.names or BENCHMARKS])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "consoleiotools": cit.__version__,
+                "rich": importlib.metadata.version("rich"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "ok": ok,
+                "results": results,
+            }, f, indent=2)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
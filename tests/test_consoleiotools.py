@@ -1,6 +1,12 @@
+import asyncio
+import io
 import unittest
+import subprocess
 import sys
 import os
+import threading
+import time
+import types
 from unittest.mock import patch
 
 from ansiesc import StringIO
@@ -23,6 +29,20 @@ class test_consoleiotools(unittest.TestCase):
     def test_version(self):
         self.assertTrue(isinstance(cit.__version__, str))
 
+    def test_lazy_import(self):
+        code = "; ".join([
+            "import sys",
+            "import consoleiotools as cit",
+            "assert 'console' not in vars(cit)",
+            "heavy = ('rich.markdown', 'rich.progress', 'rich.traceback', 'rich.panel', 'logging')",
+            "assert not [m for m in heavy if m in sys.modules], [m for m in heavy if m in sys.modules]",
+            "assert cit.console is cit.console",
+            "assert cit.theme is cit.theme",
+        ])
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
     def test_start(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
             cit.start()
@@ -75,11 +95,77 @@ class test_consoleiotools(unittest.TestCase):
             cit.echo("ABC", indent=2)
             self.assertEqual(fake_out.getvalue(), "│ ╷   ├── ABC\n")
 
+    def test_echo_prefix_cache(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            cit.echo("ABC", indent=1)
+            cit.__ascii__ = True
+            cit.echo("ABC", indent=1)
+            cit.__ascii__ = False
+            self.assertEqual(fake_out.getvalue(), "│ ├── ABC\n│ |-- ABC\n")
+        theme = cit.theme
+        self.assertEqual(cit._echo_prefix("info", "", "│", 0, False, theme)[0].spans[0].style, "info-bar")
+        self.assertEqual(cit._echo_prefix("info", "", "│", 0, False, cit.rich.theme.Theme({}))[0].spans[0].style, "info")
+
+    def test_echo_markup(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            cit.echo("[blue]ABC[/]", cit.escape("[DEF]"), indent=-2)
+            self.assertEqual(fake_out.getvalue(), "│ ╷   ╰── ABC [DEF]\n")
+
+    def test_echo_plain_wrap(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            cit.echo("ABC " * 100)
+            self.assertGreater(len(fake_out.getvalue().splitlines()), 1)  # too wide for one line, wrapped by rich
+
+    def test_echo_plain_buffered(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            console = cit._get_console()
+            with console.capture() as captured:
+                cit.info("ABC")
+            self.assertEqual(captured.get(), "│ (Info) ABC\n")
+            with console:
+                cit.print("DEF")
+                cit.info("GHI")
+            self.assertEqual(fake_out.getvalue(), "DEF\n│ (Info) GHI\n")  # in order
+
+    def test_rich_private_fallbacks(self):
+        console = types.SimpleNamespace(color_system=None, record=False, quiet=False, file=sys.stdout)  # a rich without the private attributes
+        self.assertFalse(cit._is_plain(console))  # rendered by rich, never out of order
+        self.assertIs(cit._console_file(console), sys.stdout)
+
     def test_markdown(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
             cit.markdown("### ABC")
             self.assertEqual(fake_out.getvalue().strip(), "ABC")
 
+    def test_markdown_cache(self):
+        cit.markdown_cache_clear()
+        first = cit.render(cit.markdown, "# ABC\n\n*DEF*", ansi=True)
+        self.assertEqual(cit.render(cit.markdown, "# ABC\n\n*DEF*", ansi=True), first)  # replayed from the cache
+        self.assertEqual(cit.markdown_cache_info(), {"hits": 1, "misses": 1, "maxsize": 64, "currsize": 1})
+        cit.render(cit.markdown, "# ABC\n\n*DEF*", width=40)  # another width is rendered again
+        self.assertEqual(cit.markdown_cache_info()["misses"], 2)
+        with patch.object(cit, "MARKDOWN_CACHE_SIZE", 2):
+            for text in ("GHI", "JKL", "MNO"):
+                cit.render(cit.markdown, text)
+            self.assertEqual(cit.markdown_cache_info()["currsize"], 2)  # least recent evicted
+        cit.markdown_cache_clear()
+        self.assertEqual(cit.markdown_cache_info()["currsize"], 0)
+
+    def test_markdown_file(self):
+        text = "\n".join([
+            "# ABC",
+            "DEF",
+            "```",
+            "# not a heading",
+            "```",
+            "## GHI",
+            "- JKL",
+            "    # code",
+            "### MNO",
+        ])
+        cit.write_file(self.TMP_FILE, text, overwrite=True)
+        self.assertEqual(cit.render(cit.markdown_file, self.TMP_FILE, chunk_size=8), cit.render(cit.markdown, text))
+
     def test_panel(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
             cit.panel("ABC", title="ABC", subtitle="ABC", expand=False, style="dim")
@@ -133,6 +219,87 @@ class test_consoleiotools(unittest.TestCase):
             cit.print(cit.escape("[test]ABC"))
             self.assertEqual(fake_out.getvalue(), "[test]ABC\n")
 
+    def test_buffered(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.buffered():
+                cit.info("ABC").title("DEF")
+                self.assertEqual(fake_out.getvalue(), "")
+            self.assertTrue(fake_out.getvalue().startswith("│ (Info) ABC\n╭─────╮"))
+            cit.info("GHI")
+            self.assertTrue(fake_out.getvalue().endswith("│ (Info) GHI\n"))
+
+    def test_buffered_redirect(self):
+        import contextlib
+
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stderr", new=StringIO()) as fake_err:
+            with cit.buffered(interval=60):
+                cit.info("ABC")
+                with contextlib.redirect_stdout(sys.stderr):
+                    cit.info("DEF")
+                cit.info("GHI")
+            self.assertEqual(fake_out.getvalue(), "│ (Info) ABC\n│ (Info) GHI\n")
+            self.assertEqual(fake_err.getvalue(), "│ (Info) DEF\n")
+
+    def test_buffered_limits(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.buffered(max_lines=2, interval=60):
+                cit.info("ABC")
+                self.assertEqual(fake_out.getvalue(), "")
+                cit.info("DEF")
+                self.assertEqual(fake_out.getvalue(), "│ (Info) ABC\n│ (Info) DEF\n")
+                cit.info("GHI").flush()
+                self.assertTrue(fake_out.getvalue().endswith("GHI\n"))
+
+    def test_buffered_prompt(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.buffered(interval=60):
+                cit.info("Question")
+                with patch("builtins.input", side_effect=lambda: fake_out.getvalue()):  # answer with what is on screen
+                    answer = cit.get_input(strip=False)
+            self.assertEqual(answer, "│ (Info) Question\n> ")
+
+    def test_background(self):
+        def work(n):
+            for i in range(20):
+                cit.info(f"worker {n} line {i}")
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.background(maxsize=8) as writer:
+                threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertFalse(writer.thread.is_alive())
+            lines = fake_out.getvalue().splitlines()
+            self.assertEqual(len(lines), 80)
+            self.assertTrue(all(line.startswith("│ (Info) worker ") for line in lines))
+            self.assertEqual([line for line in lines if "worker 0 " in line], [f"│ (Info) worker 0 line {i}" for i in range(20)])
+
+    def test_background_drop(self):
+        release = threading.Event()
+
+        class Blocking:
+            def __rich__(self):
+                release.wait()
+                return "ABC"
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.background(maxsize=1, on_full="drop") as writer:
+                cit.print(Blocking())
+                time.sleep(0.1)  # writer is now rendering Blocking
+                cit.info("DEF").info("GHI").info("JKL")
+                release.set()
+            self.assertEqual(writer.dropped, 2)
+            self.assertEqual(fake_out.getvalue(), "ABC\n│ (Info) DEF\n")
+
+    def test_background_prompt(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("1\n")):
+            with cit.background():
+                cit.info("ABC")
+                self.assertEqual(cit.get_choice(["DEF", "GHI"]), "DEF")
+                self.assertTrue(fake_out.getvalue().startswith("│ (Info) ABC\n│  1) DEF\n│  2) GHI\n> "))
+
     def test_pause(self):
         with patch("sys.stdin", new=StringIO("\n")):  # simulate press enter
             cit.pause()
@@ -143,6 +310,84 @@ class test_consoleiotools(unittest.TestCase):
                 print(i)
             self.assertEqual("0\n1\n2\n3\n4\n\n", fake_out.getvalue())
 
+    def test_track_throttled(self):
+        out = StringIO()
+        console = cit.rich.console.Console(file=out, width=100)
+        self.assertEqual(sum(cit.track(range(100000), console=console)), sum(range(100000)))
+        self.assertIn("100000/100000", out.getvalue())
+
+    def test_track_slowdown(self):
+        def items():
+            yield from range(300000)
+            for i in range(100):
+                time.sleep(0.002)
+                yield i
+
+        updates = []
+        progress = types.SimpleNamespace(update=lambda task, completed: updates.append(completed))
+        for _ in cit._tracked(progress, None, items(), update_period=0.05):
+            pass
+        self.assertEqual(updates[-1], 300100)
+        self.assertGreaterEqual(len([n for n in updates if 300000 < n < 300100]), 2)  # the bar keeps moving on slow items
+
+    def test_track_generator(self):
+        out = StringIO()
+        console = cit.rich.console.Console(file=out, width=100)
+        self.assertEqual(list(cit.track((i for i in range(5)), console=console)), [0, 1, 2, 3, 4])
+        self.assertIn("5/?", out.getvalue())
+        self.assertEqual(list(cit.track((i for i in range(5)), total=5, console=console)), [0, 1, 2, 3, 4])
+        self.assertIn("5/5", out.getvalue())
+
+    def test_track_bytes(self):
+        out = StringIO()
+        console = cit.rich.console.Console(file=out, width=100)
+        data = b"ABC" * 1000
+        self.assertEqual(b"".join(cit.track_bytes(io.BytesIO(data), total_bytes=len(data), chunk_size=100, console=console)), data)
+        self.assertIn("3.0/3.0 kB", out.getvalue())
+
+    def test_track_map(self):
+        out = StringIO()
+        console = cit.rich.console.Console(file=out, width=100)
+        self.assertEqual(list(cit.track_map(abs, range(0, -50, -1), workers=4, console=console)), list(range(50)))
+        self.assertIn("50/50", out.getvalue())
+        self.assertEqual(sorted(cit.track_map(abs, (-i for i in range(10)), ordered=False, disable=True)), list(range(10)))
+
+    def test_track_map_bounded(self):
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        def func(i):
+            time.sleep(0.2 if i == 0 else 0)  # results behind the first one wait for it
+            return i
+
+        out = StringIO()
+        console = cit.rich.console.Console(file=out, width=100)
+        results = cit.track_map(func, items(), workers=2, console=console)
+        self.assertEqual(next(results), 0)
+        self.assertLessEqual(len(consumed), 4)
+        self.assertEqual(list(results), list(range(1, 100)))
+
+    def test_track_map_shared(self):
+        out = StringIO()
+        with cit.progress(console=cit.rich.console.Console(file=out, width=100)) as bars:
+            self.assertEqual(list(cit.track_map(abs, [-1, -2], desc="ABC", display=bars)), [1, 2])
+            self.assertEqual(list(cit.track_map(abs, [-3], desc="DEF", display=bars)), [3])
+        self.assertEqual(len(bars.tasks), 2)
+        self.assertIn("DEF", out.getvalue())
+
+    def test_track_map_error(self):
+        def func(x):
+            if x == 3:
+                raise KeyError(x)
+            return x
+
+        with self.assertRaises(KeyError):
+            list(cit.track_map(func, range(100), disable=True))
+
     def test_bye(self):
         with patch("sys.stdout", new=StringIO()) as fake_out:
             try:
@@ -238,6 +483,11 @@ class test_consoleiotools(unittest.TestCase):
         with patch("sys.stdout", new=StringIO()), patch("sys.stdin", new=StringIO("ABC\n")):
             self.assertEqual(cit.get_choice(["ABC", "DEF"]), "ABC")
 
+    def test_get_choice_numbers(self):
+        with patch("sys.stdout", new=StringIO()), cit.answers(["1", "3"]):
+            self.assertEqual(cit.get_choice([10, 20, 1]), 10)  # numbers pick by position unless the choice is a str
+            self.assertEqual(cit.get_choice(["10", "20", "3"]), "3")
+
     def test_get_choices_done(self):
         with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("1\n0\n")):
             self.assertEqual(cit.get_choices(["ABC", "DEF"]), ["ABC", ])
@@ -279,6 +529,392 @@ class test_consoleiotools(unittest.TestCase):
             self.assertEqual(cit.get_choices(["ABC", "DEF"], allable=True, exitable=True), [])
             self.assertIn("[✓] ABC", fake_out.getvalue())
 
+    def test_get_choice_paged(self):
+        choices = [f"host-{i}" for i in range(1, 26)]
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO(">\n<\n>\n>\n>\n12\n")):
+            self.assertEqual(cit.get_choice(choices, page_size=10), "host-12")  # numbers are the same on every page
+            pages = fake_out.getvalue().split("Page ")
+            self.assertEqual(len(pages), 7)
+            self.assertIn("1/3", pages[1])
+            self.assertIn(" 1) host-1\n", pages[0])
+            self.assertNotIn("11) host-11", pages[0])
+            self.assertIn("11) host-11", pages[1])
+            self.assertIn("3/3", pages[-1])  # `>` stops at the last page
+            self.assertIn("25) host-25", pages[-2])
+            self.assertNotIn("Please enter a valid choice.", fake_out.getvalue())
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("1\n")):
+            self.assertEqual(cit.get_choice(choices, page_size=0), "host-1")
+            self.assertIn("25) host-25", fake_out.getvalue())
+            self.assertNotIn("Page", fake_out.getvalue())
+
+    def test_get_choices_filter(self):
+        choices = [f"host-{i}" for i in range(1, 26)]
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("/HOST-2\na\n3\n/\n0\n")):
+            self.assertEqual(cit.get_choices(choices, allable=True, page_size=5), ["host-2", "host-20", "host-21", "host-22", "host-23", "host-24", "host-25", "host-3"])
+            menus = fake_out.getvalue().split("Page ")
+            self.assertIn("[ ] host-20", menus[1])
+            self.assertNotIn("host-19", menus[1])
+            self.assertIn("7 of 25 matching 'HOST-2'", menus[2])
+            self.assertIn("[✓] host-20", menus[2])  # `a` selects the filtered choices only
+            self.assertIn("[✓] host-3", menus[4])
+            self.assertIn("[ ] host-4", menus[4])
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("/nothing\nhost-3\n1\nhost-3\n0\n")):
+            self.assertEqual(cit.get_choices(choices, page_size=5), ["host-1"])
+            self.assertIn("0 of 25", fake_out.getvalue())
+
+    def test_get_choice_prefix(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("app\nGOO\n")):
+            self.assertEqual(cit.get_choice(["Apple", "Applause", "Google"]), "Google")  # `app` is ambiguous
+            self.assertEqual(fake_out.getvalue().count("Please enter a valid choice."), 1)
+        with patch("sys.stdout", new=StringIO()), patch("sys.stdin", new=StringIO("1\n")):
+            self.assertEqual(cit.get_choice(["10.0.0.1", "10.0.0.2"]), "10.0.0.1")  # numbers win over prefixes
+        with patch("sys.stdout", new=StringIO()), patch("sys.stdin", new=StringIO("appla\ngo\n0\n")):
+            self.assertEqual(cit.get_choices(["Apple", "Applause", "Google"]), ["Applause", "Google"])
+
+    def test_get_choice_retry_loop(self):
+        retries = sys.getrecursionlimit() + 10
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("x\n" * retries + "2\n")):
+            self.assertEqual(cit.get_choice(["ABC", "DEF"], page_size=0), "DEF")
+            self.assertEqual(fake_out.getvalue().count("Please enter a valid choice."), retries)
+
+    def test_set_level(self):
+        calls = []
+
+        def costly():
+            calls.append(1)
+            return "DEF"
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                cit.set_level("info").debug(costly).mute("ABC").echo("GHI", style="muted").info("JKL", costly).ask("MNO")
+            finally:
+                cit.set_level("debug")
+            self.assertEqual(fake_out.getvalue(), "│ (Info) JKL DEF\n│ (?) MNO\n")
+        self.assertEqual(len(calls), 1)
+        self.assertRaises(ValueError, cit.set_level, "verbose")
+
+    def test_level(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.level("warn"):
+                cit.info("ABC").echo("DEF").warn("GHI")
+                with cit.level(40):
+                    cit.warn("JKL").err("MNO")
+                cit.warn("PQR")
+            cit.debug("STU")
+            self.assertEqual(fake_out.getvalue(), "│ (Warning) GHI\n│ (Error) MNO\n│ (Warning) PQR\n│ (Debug) STU\n")
+
+    def test_level_context(self):
+        async def task(level, name):
+            with cit.level(level):
+                await asyncio.sleep(0)  # the other task enters its level meanwhile
+                cit.info(name).err(name)
+                await asyncio.sleep(0)
+
+        async def main():
+            await asyncio.gather(task("err", "ABC"), task("debug", "DEF"))
+
+        def thread():
+            barrier.wait()
+            cit.info("GHI")  # follows set_level(), not the level() of the main thread
+            barrier.wait()
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            asyncio.run(main())
+            cit.info("JKL")
+            barrier = threading.Barrier(2)
+            worker = threading.Thread(target=thread)
+            worker.start()
+            with cit.level("err"):
+                barrier.wait()
+                barrier.wait()
+            worker.join()
+            self.assertEqual(fake_out.getvalue(), "│ (Error) ABC\n│ (Info) DEF\n│ (Error) DEF\n│ (Info) JKL\n│ (Info) GHI\n")
+
+    def test_logging_handler(self):
+        import logging
+
+        logger = logging.getLogger("test_consoleiotools")
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            handler = cit.LoggingHandler()
+            logger.addHandler(handler)
+            try:
+                logger.debug("ABC [DEF]")
+                logger.info("GHI %d", 1)
+                logger.warning("JKL")
+                with cit.level("err"):
+                    logger.warning("MNO")
+                    logger.critical("PQR")
+            finally:
+                logger.removeHandler(handler)
+            self.assertEqual(fake_out.getvalue(), "│ (Debug) ABC [DEF]\n│ (Info) GHI 1\n│ (Warning) JKL\n│ (Error) PQR\n")
+        self.assertIs(cit.LoggingHandler, cit.LoggingHandler)
+
+    def test_logging_handler_queued(self):
+        import logging
+
+        logger = logging.getLogger("test_consoleiotools.queued")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            handler = cit.LoggingHandler(queued=True, indent=1, pre="app")
+            handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+            logger.addHandler(handler)
+            try:
+                for i in range(3):
+                    logger.info("ABC %d", i)
+                logger.debug("DEF")
+            finally:
+                logger.removeHandler(handler)
+                handler.close()  # writes out the queue
+            self.assertEqual(fake_out.getvalue(), "".join(f"│ (App) ├── INFO ABC {i}\n" for i in range(3)))
+
+    def test_profiling(self):
+        info = cit.info
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("DEF\n")):
+            try:
+                cit.enable_profiling()
+                self.assertIsNot(cit.info, info)
+                cit.info("ABC").info("ABC").title("ABC")
+                for _ in cit.track(range(10), disable=True):
+                    pass
+                self.assertEqual(cit.get_input("question"), "DEF")
+                cit.write_file(self.TMP_FILE, "GHI")
+            finally:
+                cit.disable_profiling()
+            self.assertIs(cit.info, info)
+            cit.info("JKL")  # not counted
+            stats = cit.stats(reset=True)
+            self.assertEqual(stats["info"]["calls"], 2)
+            self.assertEqual(stats["info"]["bytes"], len("│ (Info) ABC\n".encode()) * 2)
+            self.assertEqual(stats["track"]["calls"], 1)
+            self.assertEqual(stats["ask"]["calls"], 1)  # nested in get_input
+            self.assertEqual(stats["input()"]["calls"], 1)
+            self.assertGreater(stats["get_input"]["time"], stats["get_input"]["input"])
+            self.assertEqual(stats["write_file"]["bytes"], 3)
+            self.assertEqual(stats["total"]["calls"], 6)
+            self.assertEqual(stats["total"]["bytes"], len(fake_out.getvalue().encode()) - len("│ (Info) JKL\n".encode()) + 3)
+            self.assertEqual(cit.stats()["total"]["calls"], 0)
+
+    def test_profiling_bytes(self):
+        def work():
+            barrier.wait()
+            for _ in range(300):
+                cit.info("ABC")
+
+        out = io.StringIO()  # keeps the ANSI codes
+        console = cit.rich.console.Console(file=out, theme=cit._get_theme(), width=80, force_terminal=True, color_system="truecolor")  # styled, slow enough for the threads to overlap
+        barrier = threading.Barrier(4)
+        with patch.object(cit, "console", console):
+            try:
+                cit.enable_profiling()
+                cit.write_file(self.TMP_FILE, "中文")
+                cit.write_file(self.TMP_FILE, content=iter(["ABC", "中文"]))
+                threads = [threading.Thread(target=work) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                cit.disable_profiling()
+            stats = cit.stats(reset=True)
+        self.assertEqual(stats["write_file"]["bytes"], 6 + 3 + 6)  # bytes as utf-8, not characters
+        self.assertEqual(cit.read_file(self.TMP_FILE), "中文ABC中文")
+        self.assertEqual(stats["info"]["calls"], 1200)
+        self.assertEqual(stats["info"]["bytes"], len(out.getvalue().encode()))  # each call counts only its own thread
+        self.assertEqual(stats["total"]["bytes"], len(out.getvalue().encode()) + 15)
+
+    def test_profiling_in_buffered(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                with cit.buffered(interval=60):
+                    cit.info("ABC")
+                    cit.enable_profiling()
+                    cit.info("DEF")
+                self.assertEqual(fake_out.getvalue(), "│ (Info) ABC\n│ (Info) DEF\n")  # drained on exit
+                self.assertIsInstance(cit.console.file, cit._CountingFile)
+            finally:
+                cit.disable_profiling()
+            self.assertIsNone(cit.console._file)
+            cit.stats(reset=True)
+
+    def test_buffered_in_profiling(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                cit.enable_profiling()
+                with cit.buffered(interval=60):
+                    cit.info("ABC")
+                    cit.disable_profiling()
+                    cit.info("DEF")
+            finally:
+                cit.disable_profiling()
+            self.assertEqual(fake_out.getvalue(), "│ (Info) ABC\n│ (Info) DEF\n")
+            self.assertIsNone(cit.console._file)  # no counting proxy left over
+            cit.stats(reset=True)
+
+    def test_print_stats(self):
+        import json
+
+        try:
+            cit.enable_profiling().rule("ABC")
+        finally:
+            cit.disable_profiling()
+        table = cit.render(cit.print_stats)
+        self.assertIn("Profiling", table)
+        self.assertRegex(table, r"rule +1 ")
+        self.assertEqual(json.loads(cit.render(cit.print_stats, "json"))["rule"]["calls"], 1)
+        self.assertRaises(ValueError, cit.print_stats, "csv")
+
+    def test_as_session_profiling(self):
+        @cit.as_session
+        def func():
+            cit.info("ABC").info("DEF")
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                cit.enable_profiling()
+                func()
+            finally:
+                cit.disable_profiling()
+            self.assertRegex(fake_out.getvalue(), r"│ 2 cit calls, [0-9.]+ ms, 30 bytes\n╰")
+
+    def test_set_backend_jsonl(self):
+        import json
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                cit.set_backend("jsonl").start().title("ABC").info("[b]DEF[/]", 1).err("GHI", indent=-2).rule("JKL").end()
+            finally:
+                cit.set_backend("rich")
+            cit.info("MNO")
+            lines = fake_out.getvalue().splitlines()
+        records = [json.loads(line) for line in lines[:-1]]
+        self.assertEqual([(r["level"], r["message"], r["indent"]) for r in records], [("title", "ABC", 0), ("info", "DEF 1", 0), ("error", "GHI", 2), ("rule", "JKL", 0)])
+        self.assertLessEqual(abs(records[0]["time"] - time.time()), 60)
+        self.assertEqual(lines[-1], "│ (Info) MNO")
+        self.assertEqual(lines[1], '{"level":"info","message":"DEF 1","indent":0,"time":%s}' % json.dumps(records[1]["time"]))  # compact
+
+    def test_set_backend_jsonl_flush(self):
+        class File(io.StringIO):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+
+        file = File()
+        console = cit.rich.console.Console(file=file)
+        with patch.object(cit, "console", console):
+            try:
+                cit.set_backend("jsonl")
+                for i in range(100):
+                    cit.info(i)
+                self.assertEqual(file.flushes, 0)  # left to the file buffer
+                cit.warn("ABC")
+                self.assertEqual(file.flushes, 1)
+                cit.info("DEF").flush()
+                self.assertEqual(file.flushes, 2)
+            finally:
+                cit.set_backend("rich")
+        self.assertEqual(len(file.getvalue().splitlines()), 102)
+
+    def test_set_backend_callable(self):
+        records = []
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            try:
+                cit.set_backend(records.append).warn("ABC").mute("DEF")
+            finally:
+                cit.set_backend()
+            self.assertEqual(fake_out.getvalue(), "")
+        self.assertEqual([(r["level"], r["message"]) for r in records], [("warning", "ABC"), ("muted", "DEF")])
+        self.assertRaises(ValueError, cit.set_backend, "xml")
+
+    def test_capture(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.capture(width=20) as buf:
+                cit.info("ABC").rule("")
+                with cit.capture() as inner:
+                    cit.echo("DEF")
+                cit.echo("GHI")
+            cit.echo("JKL")
+            self.assertEqual(buf.getvalue(), "│ (Info) ABC\n" + "─" * 20 + "\n│ GHI\n")
+            self.assertEqual(inner.getvalue(), "│ DEF\n")
+            self.assertEqual(fake_out.getvalue(), "│ JKL\n")
+
+    def test_render(self):
+        self.assertEqual(cit.render(cit.warn, "ABC"), "│ (Warning) ABC\n")
+        self.assertEqual(cit.render(cit.title, "ABC"), "╭─────╮\n│ ABC │\n╰─────╯\n")
+        self.assertIn("\x1b[", cit.render(cit.warn, "ABC", ansi=True))
+        self.assertEqual(len(cit.render(cit.rule, "", width=33).rstrip("\n")), 33)
+        with patch("sys.stdout", new=StringIO()) as fake_out, cit.background():
+            self.assertEqual(cit.render(cit.err, "ABC"), "│ (Error) ABC\n")  # not queued to the writer thread
+        self.assertEqual(fake_out.getvalue(), "")
+
+    def test_capture_threads(self):
+        def work(i):
+            return cit.render(lambda: cit.info(i).echo(i, indent=1))
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, work(i))) for i in range(8)]
+            results = {}
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(fake_out.getvalue(), "")
+        self.assertEqual(results, {i: f"│ (Info) {i}\n│ ├── {i}\n" for i in range(8)})
+
+    def test_answers(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out, cit.answers(iter(["2\n", "ABC\n"])):
+            self.assertEqual(cit.get_choice(["ABC", "DEF"]), "DEF")
+            cit.pause()  # takes no answer
+            self.assertEqual(cit.get_input("question"), "ABC")
+            self.assertRaises(EOFError, cit.get_input)
+            self.assertIn("│  2) DEF\n> 2\n│ (?) question\n> ABC\n", fake_out.getvalue())
+        with patch("sys.stdout", new=StringIO()), patch("sys.stdin", new=StringIO("GHI\n")):
+            self.assertEqual(cit.get_input(), "GHI")  # back to stdin
+        self.assertRaises(ValueError, cit.answers, "ABC")
+
+    def test_answers_by_question(self):
+        with patch("sys.stdout", new=StringIO()), cit.answers({"Name?": "ABC", "Pick": ["1", "2", "0"], "Async": "2"}):
+            cit.ask("Pick")
+            self.assertEqual(cit.get_choices(["ABC", "DEF"]), ["ABC", "DEF"])
+            self.assertEqual(cit.get_input("Name?"), "ABC")
+            with self.assertRaisesRegex(EOFError, "Name"):
+                cit.get_input("Name?")
+            cit.ask("Async")
+            self.assertEqual(asyncio.run(cit.aget_choice(["ABC", "DEF"])), "DEF")
+
+    def test_answers_quiet(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.answers(["x", "ABC"], quiet=True):
+                self.assertEqual(cit.get_choice(["ABC", "DEF"]), "ABC")
+                self.assertEqual(fake_out.getvalue(), "")
+                cit.info("GHI")
+            self.assertEqual(fake_out.getvalue(), "│ (Info) GHI\n")
+
+    def test_aget_input(self):
+        async def main():
+            async def type_answer():
+                await asyncio.sleep(0.05)  # only runs if the loop is not blocked by the prompt
+                os.write(w, b"ABC\n")
+
+            typing = asyncio.create_task(type_answer())
+            answer = await asyncio.wait_for(cit.aget_input("question"), timeout=5)
+            await typing
+            return answer
+
+        r, w = os.pipe()
+        with os.fdopen(r) as stdin, patch("sys.stdin", new=stdin), patch("sys.stdout", new=StringIO()) as fake_out:
+            self.assertEqual(asyncio.run(main()), "ABC")
+            self.assertEqual(fake_out.getvalue(), "│ (?) question\n> ")
+        os.close(w)
+
+    def test_aget_choices(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out, patch("sys.stdin", new=StringIO("2\n0\n")):
+            self.assertEqual(asyncio.run(cit.aget_choices(["ABC", "DEF"])), ["DEF"])
+            self.assertIn("DONE", fake_out.getvalue())
+
     def test_as_session_1(self):
         @cit.as_session
         def func():
@@ -286,12 +922,12 @@ class test_consoleiotools(unittest.TestCase):
 
         with patch("sys.stdout", new=StringIO()) as fake_out:
             func()
-            self.assertEqual(fake_out.getvalue().strip(), "\n".join([
+            self.assertRegex(fake_out.getvalue().strip(), "\n".join([
                 "╭──────╮",
                 "│ FUNC │",
                 "╰──────╯",
                 "ABC",
-                "╰",
+                r"╰ [0-9.]+ ms$",
             ]))
 
     def test_as_session_2(self):
@@ -301,12 +937,12 @@ class test_consoleiotools(unittest.TestCase):
 
         with patch("sys.stdout", new=StringIO()) as fake_out:
             func()
-            self.assertEqual(fake_out.getvalue().strip(), "\n".join([
+            self.assertRegex(fake_out.getvalue().strip(), "\n".join([
                 "╭─────╮",
                 "│ DEF │",
                 "╰─────╯",
                 "ABC",
-                "╰",
+                r"╰ [0-9.]+ ms$",
             ]))
 
     def test_as_session_3(self):
@@ -316,14 +952,72 @@ class test_consoleiotools(unittest.TestCase):
 
         with patch("sys.stdout", new=StringIO()) as fake_out:
             underscore_orCamel()
-            self.assertEqual(fake_out.getvalue().strip(), "\n".join([
+            self.assertRegex(fake_out.getvalue().strip(), "\n".join([
                 "╭─────────────────────╮",
                 "│ UNDERSCORE OR CAMEL │",
                 "╰─────────────────────╯",
                 "ABC",
-                "╰",
+                r"╰ [0-9.]+ ms$",
             ]))
 
+    def test_session(self):
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with cit.session("ABC"):
+                cit.info("DEF")
+                with cit.session("GHI") as c:
+                    c.echo("JKL").echo("MNO", indent=-1)
+                    with cit.session("PQR"):
+                        cit.warn("STU")
+                cit.echo("VWX")
+            cit.echo("YZ")
+            lines = fake_out.getvalue().splitlines()
+        self.assertEqual(lines[:10], [
+            "",
+            "╭─────╮",
+            "│ ABC │",
+            "╰─────╯",
+            "│ (Info) DEF",
+            "│ ├── GHI",
+            "│ ╷   ├── JKL",
+            "│ ╷   ╷   ╰── MNO",
+            "│ ╷   ╷   ├── PQR",
+            "│ (Warning) ╷   ╷   ╷   ├── STU",
+        ])
+        self.assertRegex(lines[10], r"^│ ╷   ╷   ╷   ╰── [0-9.]+ ms$")
+        self.assertRegex(lines[11], r"^│ ╷   ╰── [0-9.]+ ms$")
+        self.assertEqual(lines[12], "│ VWX")
+        self.assertRegex(lines[13], r"^╰ [0-9.]+ ms$")
+        self.assertEqual(lines[14], "│ YZ")
+
+    def test_session_error(self):
+        @cit.as_session("DEF")
+        def func():
+            raise KeyError("GHI")
+
+        with patch("sys.stdout", new=StringIO()) as fake_out:
+            with self.assertRaises(KeyError), cit.session("ABC"):
+                func()
+            cit.echo("JKL")
+            lines = fake_out.getvalue().splitlines()
+        self.assertEqual(lines[4], "│ ├── DEF")
+        self.assertRegex(lines[5], r"^│ ╷   ╰── KeyError [0-9.]+ ms$")
+        self.assertRegex(lines[6], r"^╰ KeyError [0-9.]+ ms$")
+        self.assertEqual(lines[7], "│ JKL")  # indent is back to 0
+
+    def test_session_times(self):
+        with patch("sys.stdout", new=StringIO()):
+            for _ in range(3):
+                with cit.session("test_session_times"):
+                    time.sleep(0.01)
+        times = cit.session_times()["test_session_times"]
+        self.assertEqual(times["calls"], 3)
+        self.assertGreaterEqual(times["min"], 0.01)
+        self.assertAlmostEqual(times["mean"] * 3, times["total"])
+        self.assertLessEqual(times["max"], times["total"])
+        self.assertEqual(cit._format_elapsed(0.0123), "12.3 ms")
+        self.assertEqual(cit._format_elapsed(1.5), "1.50 s")
+        self.assertEqual(cit._format_elapsed(125), "2m 05s")
+
     def test_deprecated_by(self):
         @cit.deprecated_by(print)
         def old_func(s: str):
@@ -344,6 +1038,32 @@ class test_consoleiotools(unittest.TestCase):
         len_write = cit.write_file(self.TMP_FILE, content, overwrite=True)
         self.assertEqual(len_write, len(content))
 
+    def test_write_file_iterable(self):
+        len_write = cit.write_file(self.TMP_FILE, (f"{i}\n" for i in range(3)), overwrite=True)
+        self.assertEqual(len_write, 6)
+        self.assertEqual(cit.read_file(self.TMP_FILE), "0\n1\n2\n")
+
+    def test_open_writer(self):
+        cit.write_file(self.TMP_FILE, "ABC\n", overwrite=True)
+        with cit.open_writer(self.TMP_FILE) as writer:
+            writer.write("DEF\n")
+            self.assertEqual(writer.writelines(["GHI\n", "JKL\n"]), 8)
+        self.assertEqual(writer.written, 12)
+        self.assertEqual(cit.read_file(self.TMP_FILE), "ABC\nDEF\nGHI\nJKL\n")
+
+    def test_open_writer_atomic(self):
+        cit.write_file(self.TMP_FILE, "ABC\n", overwrite=True)
+        with cit.open_writer(self.TMP_FILE, atomic=True) as writer:
+            writer.write("DEF\n")
+            self.assertEqual(cit.read_file(self.TMP_FILE), "ABC\n")  # not replaced yet
+        self.assertEqual(cit.read_file(self.TMP_FILE), "ABC\nDEF\n")
+        with self.assertRaises(RuntimeError):
+            with cit.open_writer(self.TMP_FILE, overwrite=True, atomic=True) as writer:
+                writer.write("GHI\n")
+                raise RuntimeError()
+        self.assertEqual(cit.read_file(self.TMP_FILE), "ABC\nDEF\n")  # discarded
+        self.assertEqual([name for name in os.listdir(".") if name.startswith(self.TMP_FILE + ".")], [])
+
     def test_read_file(self):
         content = "3.1415926"
         len_write = cit.write_file(self.TMP_FILE, content)
@@ -359,6 +1079,85 @@ class test_consoleiotools(unittest.TestCase):
         self.assertEqual(content_read, content)
         self.assertEqual(encoding, "utf-8")
 
+    def test_read_file_encodings(self):
+        for content, encoding in (("中文\r\n", "gbk"), ("café\n", "cp1252")):
+            with open(self.TMP_FILE, "wb") as f:
+                f.write(content.encode(encoding))
+            self.assertEqual(cit.read_file(self.TMP_FILE, with_encoding=True), (content.replace("\r\n", "\n"), encoding))
+
+    def test_read_file_options(self):
+        with open(self.TMP_FILE, "wb") as f:
+            f.write(b"ABC\r\nDEF\rGHI")
+        self.assertEqual(cit.read_file(self.TMP_FILE), "ABC\nDEF\nGHI")
+        self.assertEqual(cit.read_file(self.TMP_FILE, newline="", buffering=0), "ABC\r\nDEF\rGHI")  # open() options still work
+        with open(self.TMP_FILE, "ab") as f:
+            f.write(b"\xff")
+        self.assertEqual(cit.read_file(self.TMP_FILE, errors="replace", with_encoding=True), ("ABC\nDEF\nGHI\ufffd", "utf-8"))
+        with self.assertRaises(TypeError):
+            cit.read_file(self.TMP_FILE, mode="w")
+
+    def test_read_file_cache(self):
+        cit.file_cache_clear()
+        with open(self.TMP_FILE, "wb") as f:
+            f.write("中文".encode("gbk"))
+        self.assertEqual(cit.read_file(self.TMP_FILE, with_encoding=True), ("中文", "gbk"))
+        self.assertEqual(cit.read_file(self.TMP_FILE, with_encoding=True), ("中文", "gbk"))
+        self.assertEqual(cit.file_cache_info()["hits"], 1)
+        self.assertEqual(cit.file_cache_info()["misses"], 1)
+        cit.write_file(self.TMP_FILE, "ABC")  # size changed
+        self.assertEqual(cit.read_file(self.TMP_FILE, memoize=True), "中文ABC")
+        self.assertEqual(cit.read_file(self.TMP_FILE), "中文ABC")
+        self.assertEqual(cit.file_cache_info()["misses"], 2)
+        self.assertEqual(cit.file_cache_info()["currsize"], 2)
+        cit.file_cache_clear()
+        self.assertEqual(cit.file_cache_info()["currsize"], 0)
+
+    def test_read_files(self):
+        cit.write_file(self.TMP_FILE, "ABC", overwrite=True)
+        missing = self.TMP_FILE + ".missing"
+        results = list(cit.read_files([self.TMP_FILE, missing, self.TMP_FILE], workers=2, with_encoding=True))
+        self.assertEqual([path for path, _, _ in results], [self.TMP_FILE, missing, self.TMP_FILE])
+        self.assertEqual(results[0], (self.TMP_FILE, ("ABC", "utf-8"), None))
+        self.assertIsNone(results[1][1])
+        self.assertIsInstance(results[1][2], FileNotFoundError)
+        unordered = list(cit.read_files([self.TMP_FILE, missing], ordered=False))
+        self.assertEqual(sorted(path for path, _, _ in unordered), sorted([self.TMP_FILE, missing]))
+
+    def test_read_files_lazy(self):
+        import itertools
+
+        cit.write_file(self.TMP_FILE, "ABC", overwrite=True)
+        endless = itertools.repeat(self.TMP_FILE)  # paths are taken as workers free up, never all at once
+        self.assertEqual([result for _, result, _ in itertools.islice(cit.read_files(endless, workers=2), 5)], ["ABC"] * 5)
+        results = list(cit.read_files([self.TMP_FILE, self.TMP_FILE + ".missing"], workers=2, executor="process"))
+        self.assertEqual(results[0], (self.TMP_FILE, "ABC", None))
+        self.assertIsInstance(results[1][2], FileNotFoundError)
+
+    def test_iter_file(self):
+        content = "ABC\r\n" * 10 + "中文\n" * 10
+        with open(self.TMP_FILE, "wb") as f:
+            f.write(content.encode("gbk"))  # the ascii sample looks like utf-8, then falls back to gbk
+        chunks = list(cit.iter_file(self.TMP_FILE, chunk_size=3, sample_size=10))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual("".join(chunks), content.replace("\r\n", "\n"))
+
+    def test_iter_lines(self):
+        cit.write_file(self.TMP_FILE, "ABC\nDEF\r\n\nGHI")
+        self.assertEqual(list(cit.iter_lines(self.TMP_FILE, chunk_size=2)), ["ABC\n", "DEF\n", "\n", "GHI"])
+
+    def test_map_file(self):
+        with open(self.TMP_FILE, "wb") as f:
+            f.write("ABC\r\n中文\n\nDEF".encode("utf-8"))
+        with cit.map_file(self.TMP_FILE) as mapped:
+            self.assertEqual(mapped.encoding, "utf-8")
+            self.assertEqual(mapped.line(1), "中文")
+            self.assertEqual(mapped.lines(2), ["", "DEF"])
+            self.assertEqual(mapped.line_count, 4)
+            self.assertEqual(bytes(mapped.data[:3]), b"ABC")
+            self.assertEqual(mapped.text(5, 11), "中文")
+            with self.assertRaises(IndexError):
+                mapped.line(4)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2, exit=False)